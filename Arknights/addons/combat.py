@@ -82,7 +82,7 @@ class CombatAddon(AddonBase):
         self.loots = {}
         self.use_penguin_report = app.config.combat.penguin_stats.enabled
         if self.use_penguin_report:
-            self.penguin_reporter = penguin_stats.reporter.PenguinStatsReporter()
+            self.penguin_reporter = penguin_stats.reporter.AsyncPenguinStatsReporter()
         self.refill_count = 0
         self.max_refill_count = None
 
@@ -153,11 +153,8 @@ class CombatAddon(AddonBase):
                 self.logger.info("Operations completed: %d", count)
                 self.frontend.notify("completed-count", count)
                 if count != desired_count:
-                    # 2019.10.06 更新逻辑后，提前点击后等待时间包括企鹅物流
-                    if app.config.combat.penguin_stats.enabled:
-                        self.delay(SMALL_WAIT, randomize=True, allow_skip=True)
-                    else:
-                        self.delay(BIG_WAIT, randomize=True, allow_skip=True)
+                    # 企鹅物流汇报在后台进行，不再占用等待时间
+                    self.delay(BIG_WAIT, randomize=True, allow_skip=True)
         except StopIteration:
             # count: succeeded count
             self.logger.error("Cannot start next operation")
@@ -191,7 +191,7 @@ class AutoCreditStoreAddOn(AddonBase):
         infos = inventory.get_all_item_details_in_screen(
             screen, exclude_item_ids={"other"}, only_normal_items=False
         )
-        cv_screen = screen
+        cv_screen = screen.copy()
         h, w = cv_screen.height, cv_screen.width
         ratio = h / 720
         values, prices = [0], [0]
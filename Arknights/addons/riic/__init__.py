@@ -657,7 +657,6 @@ class RIICAddon(AddonBase):
             return 1
         cmd = argv[1]
         self.refresh_cache()
-        self.refresh_cache()
         if cmd == "collect":
             self.collect_all()
             return 0
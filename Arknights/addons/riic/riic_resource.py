@@ -2,6 +2,7 @@ import sys
 from pathlib import Path
 from imgreco import resources
 import os
+import time
 import glob
 import pickle
 import io
@@ -147,14 +148,104 @@ def load_pack(stream):
     return store
 
 
+def _unpacked_cache_root():
+    import app
+
+    return app.cache_path / "riic_pack"
+
+
+def _clipslice_key():
+    return [
+        portrait_mask_64_clipbox.x,
+        portrait_mask_64_clipbox.y,
+        portrait_mask_64_clipbox.right,
+        portrait_mask_64_clipbox.bottom,
+    ]
+
+
+_stale_tmp_age = 3600
+
+
+def save_unpacked(store, path: Path):
+    """write pack as .npy arrays and index.json, replacing other unpacked versions"""
+    import json
+    import shutil
+
+    root = path.parent
+    os.makedirs(root, exist_ok=True)
+    tmppath = root / ("%s.%d.tmp" % (path.name, os.getpid()))
+    shutil.rmtree(tmppath, ignore_errors=True)
+    os.makedirs(tmppath)
+    index = {"arrays": [], "clipbox": _clipslice_key()}
+    for k in __store_keys__:
+        value = store[k]
+        if isinstance(value, np.ndarray):
+            np.save(tmppath / (k + ".npy"), value)
+            index["arrays"].append(k)
+        else:
+            index[k] = value
+    # 预先裁剪好的连续数组，匹配时不必再从 portrait_stack 切片
+    maskclip = np.ascontiguousarray(
+        store["portrait_stack"][(slice(None), *portrait_mask_64_clipslice)]
+    )
+    np.save(tmppath / "portrait_maskclip_stack.npy", maskclip)
+    index["arrays"].append("portrait_maskclip_stack")
+    # index.json 最后写入，作为完整性标记
+    with open(tmppath / "index.json", "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    try:
+        os.replace(tmppath, path)
+    except OSError:
+        # 其他进程已经写好了同一版本
+        shutil.rmtree(tmppath, ignore_errors=True)
+    now = time.time()
+    for stale in root.iterdir():
+        if stale.name == path.name:
+            continue
+        if stale.name.endswith(".tmp"):
+            # 其他进程可能正在写入；只清理长时间未更新（被中断）的临时目录
+            try:
+                if now - stale.stat().st_mtime < _stale_tmp_age:
+                    continue
+            except OSError:
+                continue
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def load_unpacked(path: Path):
+    """load unpacked pack with memory-mapped arrays, returns None if missing"""
+    import json
+
+    try:
+        with open(path / "index.json", "r", encoding="utf-8") as f:
+            index = json.load(f)
+        store = {k: v for k, v in index.items() if k not in ("arrays", "clipbox")}
+        for k in index["arrays"]:
+            store[k] = np.load(path / (k + ".npy"), mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+        return None
+    if index.get("clipbox") != _clipslice_key():
+        store.pop("portrait_maskclip_stack", None)
+    return store
+
+
 def apply_pack(store):
     global portrait_maskclip_stack
     for k in __store_keys__:
         globals()[k] = store[k]
-    portrait_maskclip_stack = portrait_stack[(slice(None), *portrait_mask_64_clipslice)]
+    if "portrait_maskclip_stack" in store:
+        portrait_maskclip_stack = store["portrait_maskclip_stack"]
+    else:
+        portrait_maskclip_stack = np.ascontiguousarray(
+            portrait_stack[(slice(None), *portrait_mask_64_clipslice)]
+        )
+
+
+_applied_pack_key = None
 
 
 def refresh_pack():
+    global _applied_pack_key
     try:
         from Arknights.gamedata_loader import session
 
@@ -164,20 +255,37 @@ def refresh_pack():
         if pack_version != "" and resp.from_cache:
             return
         resp.raise_for_status()
-        bio = io.BytesIO(resp.content)
+        packdata = resp.content
     except:
         if pack_version != "":
             return
         import app
 
-        bio = open(app.cache_path / "riic_pack.xz", "rb")
-    store = load_pack(bio)
-    bio.close()
+        with open(app.cache_path / "riic_pack.xz", "rb") as f:
+            packdata = f.read()
+    import hashlib
+
+    # 以压缩包内容作为版本键，只在远端资源包变化时重新解包
+    key = hashlib.blake2b(packdata, digest_size=16).hexdigest()
+    if key == _applied_pack_key:
+        return
+    path = _unpacked_cache_root() / key
+    store = load_unpacked(path)
+    if store is None:
+        logger.debug("unpacking riic_pack to %s", path)
+        store = load_pack(io.BytesIO(packdata))
+        try:
+            save_unpacked(store, path)
+        except OSError:
+            logger.debug("failed to unpack riic_pack", exc_info=True)
+        # 无法写入缓存目录时直接使用内存中的数据
+        store = load_unpacked(path) or store
     from Arknights import gamedata_loader
 
     if store["gamedata_version"].strip() != gamedata_loader.get_version().strip():
         logger.warning("riic_pack gamedata version mismatch")
     apply_pack(store)
+    _applied_pack_key = key
 
 
 def update_pack(filename):
@@ -168,9 +168,10 @@ class StageNavigator(AddonBase):
         import imgreco.map
 
         lastpos = None
+        tracker = imgreco.map.MapTracker(partition)
         while True:
             screenshot = self.screenshot()
-            recoresult = imgreco.map.recognize_map(screenshot, partition)
+            recoresult = tracker.recognize(screenshot)
             if recoresult is None:
                 # TODO: retry
                 self.logger.error("Failed to locate level")
@@ -208,11 +209,11 @@ class StageNavigator(AddonBase):
                         if abs(diff) < 100:
                             diff = -120
                         diff = max(diff, -originX)
+                    movement = (diff * 0.7 * uniform(0.8, 1.2), 0)
                     self.control.touch_swipe2(
-                        (originX, originY),
-                        (diff * 0.7 * uniform(0.8, 1.2), 0),
-                        max(250, diff / 2),
+                        (originX, originY), movement, max(250, diff / 2)
                     )
+                    tracker.notify_swipe(movement)
                     self.delay(5)
                     continue
 
@@ -90,6 +90,12 @@ class root(Schema):
             "Wait for network stability before executing the operation",
             "Wait for network stability before executing the operation",
         )
+        defer_color_conversion = Field(
+            bool,
+            True,
+            "Defer screenshot color conversion",
+            "Convert Display P3 screenshots to sRGB only in the regions read by recognizers, instead of the whole frame. Steps reading the whole frame (such as waiting for the screen to settle) still convert it once.",
+        )
 
         @Namespace("List of devices")
         class extra_enumerators:
@@ -176,6 +182,12 @@ class root(Schema):
         backend = EnumField(
             ["auto", "tesseract", "baidu"], "auto", "default OCR backend"
         )
+        tesseract_pool_size = Field(
+            int,
+            0,
+            "Tesseract engine pool size",
+            "Number of libtesseract instances per language that can recognize concurrently. 0 means number of CPU cores (up to 4).",
+        )
 
         @Namespace("Baidu OCR API settings")
         class baidu_api:
@@ -206,3 +218,9 @@ class root(Schema):
         )
 
     debug = Field(bool, False)
+    imgreco_trace = Field(
+        bool,
+        False,
+        "Record recognition trace",
+        "Record recognizer inputs and results to log/trace for replay with `python -m imgreco replay`",
+    )
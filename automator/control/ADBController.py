@@ -1,4 +1,5 @@
 from __future__ import annotations
+from dataclasses import dataclass
 from typing import Optional, Protocol, cast
 
 import io
@@ -18,7 +19,8 @@ import numpy as np
 import app
 
 from util import cvimage
-from util.socketutil import recvall
+from util.framesig import FrameSignature, compute_signature
+from util.socketutil import recvall, recvexactly, recvexactly_into, drain
 from .adb.revconn import ReverseConnectionHost
 from .adb.client import ADBDevice, ADBServer
 from .adb.info import ADBControllerDeviceInfo
@@ -36,6 +38,89 @@ from .types import (
 logger = logging.getLogger(__name__)
 
 
+SWIPE_FRAME_TIME = 1 / 100
+
+
+class SwipePath:
+    """precomputed touch path of a swipe"""
+
+    def __init__(
+        self,
+        x0,
+        y0,
+        x1,
+        y1,
+        move_duration=1,
+        hold_before_release=0,
+        interpolation="linear",
+        frame_time=SWIPE_FRAME_TIME,
+    ):
+        self.start = (x0, y0)
+        self.end = (x1, y1)
+        self.move_duration = move_duration
+        self.hold_before_release = hold_before_release
+        self.frame_time = frame_time
+        if interpolation == "linear":
+            self._interpolate = lambda x: x
+        elif interpolation == "spline":
+            import scipy.interpolate
+
+            xs = [0, random.uniform(0.7, 0.8), 1, 2]
+            ys = [0, random.uniform(0.9, 0.95), 1, 1]
+            tck = scipy.interpolate.splrep(xs, ys, s=0)
+            self._interpolate = lambda x: scipy.interpolate.splev(x, tck, der=0)
+        else:
+            raise ValueError("unknown interpolation mode %r" % interpolation)
+
+    def position_at(self, t):
+        """position of the pointer t seconds after touch down"""
+        if t >= self.move_duration:
+            return self.end
+        (x0, y0), (x1, y1) = self.start, self.end
+        path_progress = self._interpolate(t / self.move_duration)
+        return int(x0 + (x1 - x0) * path_progress), int(y0 + (y1 - y0) * path_progress)
+
+    def move_events(self):
+        """list of (time offset, x, y) of MOVE events, the last one at the end point"""
+        count = max(int(self.move_duration / self.frame_time), 1)
+        times = np.arange(1, count) * self.frame_time
+        (x0, y0), (x1, y1) = self.start, self.end
+        path_progress = np.asarray(self._interpolate(times / self.move_duration))
+        xs = (x0 + (x1 - x0) * path_progress).astype(int)
+        ys = (y0 + (y1 - y0) * path_progress).astype(int)
+        events = list(zip(times.tolist(), xs.tolist(), ys.tolist()))
+        events.append((self.move_duration, x1, y1))
+        return events
+
+
+@dataclass
+class SwipeTiming:
+    """requested versus actual cadence of a batched swipe"""
+
+    requested_interval: float
+    requested_duration: float
+    planned_events: int
+    sent_events: int
+    actual_duration: float
+    mean_interval: float
+    max_interval: float
+
+    def __str__(self):
+        return (
+            "%d/%d events in %.0f ms (requested %.0f ms), "
+            "interval mean %.1f ms max %.1f ms (requested %.1f ms)"
+            % (
+                self.sent_events,
+                self.planned_events,
+                self.actual_duration * 1000,
+                self.requested_duration * 1000,
+                self.mean_interval * 1000,
+                self.max_interval * 1000,
+                self.requested_interval * 1000,
+            )
+        )
+
+
 class _TouchEventsInputImpl(InputProtocol):
     def touch_tap(self, x: int, y: int, hold_time: float = 0) -> None:
         self.touch_event(EventAction.DOWN, x, y)
@@ -57,16 +142,10 @@ class _TouchEventsInputImpl(InputProtocol):
             raise NotImplementedError(
                 "default implementation of touch_swipe requires low-latency input"
             )
-        if interpolation == "linear":
-            interpolate = lambda x: x
-        elif interpolation == "spline":
-            import scipy.interpolate
-
-            xs = [0, random.uniform(0.7, 0.8), 1, 2]
-            ys = [0, random.uniform(0.9, 0.95), 1, 1]
-            tck = scipy.interpolate.splrep(xs, ys, s=0)
-            interpolate = lambda x: scipy.interpolate.splev(x, tck, der=0)
-        frame_time = 1 / 100
+        path = SwipePath(
+            x0, y0, x1, y1, move_duration, hold_before_release, interpolation
+        )
+        frame_time = path.frame_time
 
         start_time = time.perf_counter()
         end_time = start_time + move_duration
@@ -79,13 +158,7 @@ class _TouchEventsInputImpl(InputProtocol):
             t0 = time.perf_counter()
             if t0 > end_time:
                 break
-            time_progress = (t0 - start_time) / move_duration
-            path_progress = interpolate(time_progress)
-            self.touch_event(
-                EventAction.MOVE,
-                int(x0 + (x1 - x0) * path_progress),
-                int(y0 + (y1 - y0) * path_progress),
-            )
+            self.touch_event(EventAction.MOVE, *path.position_at(t0 - start_time))
             t1 = time.perf_counter()
             step_time = t1 - t0
             if step_time < frame_time:
@@ -120,6 +193,10 @@ class ShellInputAdapter(InputProtocol):
             self.support_motion_events = True
         else:
             self.caps = ControllerCapabilities(0)
+        self.last_swipe_timing: Optional[SwipeTiming] = None
+
+    def get_input_capabilities(self) -> ControllerCapabilities:
+        return self.caps
 
     def touch_tap(self, x, y, hold_time=0):
         if hold_time > 0:
@@ -140,10 +217,10 @@ class ShellInputAdapter(InputProtocol):
         interpolation="linear",
     ):
         if self.support_motion_events:
-            # use default implementation if `input motionevent` is supported
-            return _TouchEventsInputImpl.touch_swipe(
-                self, x0, y0, x1, y1, move_duration, hold_before_release, interpolation
+            path = SwipePath(
+                x0, y0, x1, y1, move_duration, hold_before_release, interpolation
             )
+            return self._touch_swipe_batched(path)
         if hold_before_release > 0:
             warnings.warn(
                 "hold_before_release is not supported in shell mode, you may experience unexpected inertia scrolling"
@@ -156,6 +233,68 @@ class ShellInputAdapter(InputProtocol):
             f"{self.input_command} swipe {x0} {y0} {x1} {y1} {move_duration*1000:.0f}"
         )
 
+    def _compile_swipe_script(self, path: SwipePath):
+        """
+        shell script replaying the whole swipe on device
+
+        events are scheduled against /proc/uptime (in centiseconds), events
+        already behind schedule are dropped to keep the requested speed, and
+        the time each event is sent is printed for the timing report.
+        """
+        motionevent = self.input_command + " motionevent"
+        events = path.move_events()
+        schedule = " ".join(
+            "%d:%d:%d" % (round(t * 100), x, y) for t, x, y in events[:-1]
+        )
+        t_end, x1, y1 = events[-1]
+        lines = [
+            "now() { read u _ </proc/uptime; n=$((${u%.*}${u#*.}-s)); }",
+            "wait_until() { now; d=$(($1-n)); "
+            "[ $d -gt 0 ] && sleep $((d/100)).$((d/10%10))$((d%10)); }",
+            "read u _ </proc/uptime; s=${u%.*}${u#*.}",
+            "%s DOWN %d %d; r=0" % (motionevent, *path.start),
+        ]
+        if schedule:
+            lines += [
+                "for e in %s; do" % schedule,
+                "t=${e%%:*}; e=${e#*:}; now; [ $n -gt $t ] && continue",
+                'wait_until $t; now; %s MOVE ${e%%:*} ${e#*:}; r="$r $n"' % motionevent,
+                "done",
+            ]
+        lines.append(
+            'wait_until %d; now; %s MOVE %d %d; r="$r $n"'
+            % (round(t_end * 100), motionevent, x1, y1)
+        )
+        if path.hold_before_release > 0:
+            lines.append("sleep %.2f" % path.hold_before_release)
+        lines.append("%s UP %d %d" % (motionevent, x1, y1))
+        lines.append('echo "swipe-timing:$r"')
+        return "\n".join(lines)
+
+    def _touch_swipe_batched(self, path: SwipePath):
+        script = self._compile_swipe_script(path)
+        output = self.controller.adb.exec(script).decode("utf-8", "replace")
+        timestamps = None
+        for line in output.splitlines():
+            if line.startswith("swipe-timing:"):
+                timestamps = [int(x) / 100 for x in line[13:].split()]
+            elif line.strip():
+                logger.debug("input: %s", line)
+        if timestamps is None:
+            logger.warning("batched swipe did not complete: %r", output)
+            return
+        intervals = np.diff(timestamps)
+        self.last_swipe_timing = SwipeTiming(
+            requested_interval=path.frame_time,
+            requested_duration=path.move_duration,
+            planned_events=len(path.move_events()),
+            sent_events=len(intervals),
+            actual_duration=timestamps[-1],
+            mean_interval=float(intervals.mean()) if len(intervals) else 0.0,
+            max_interval=float(intervals.max()) if len(intervals) else 0.0,
+        )
+        logger.debug("swipe timing: %s", self.last_swipe_timing)
+
     def send_text(self, text):
         escaped_text = shlex.quote(text)
         self.controller.adb.exec(f"{self.input_command} text {escaped_text}")
@@ -240,29 +379,80 @@ class ShellScreenshotAdapter(ScreenshotProtocol):
     def __repr__(self):
         return f"<{self.__class__.__name__} {self._impl.__name__}>"
 
-    def _decode_screencap(self, data) -> cvimage.Image:
-        w, h, format = struct.unpack_from("<III", data, 0)
-        hdrlen = 0
-        if self.controller.sdk_version >= 28:
-            # new format for Android P
-            colorspace = struct.unpack_from("<I", data, 12)[0]
-            hdrlen = 16
+    @property
+    def _screencap_header_len(self):
+        # new format for Android P
+        return 16 if self.controller.sdk_version >= 28 else 12
+
+    def _parse_screencap_header(self, header):
+        w, h, format = struct.unpack_from("<III", header, 0)
+        if len(header) >= 16:
+            colorspace = struct.unpack_from("<I", header, 12)[0]
         else:
             colorspace = 0
-            hdrlen = 12
-        logger.debug(f"{w=} {h=} {format=} datalen={len(data)}")
-        if len(data) < hdrlen + w * h * 4:
-            raise ValueError("screencap short read")
-        pixels = data[hdrlen:]
-        arr: np.ndarray = np.frombuffer(pixels, dtype=np.uint8)
-        arr = arr.reshape((h, w, 4))
-        im = cvimage.fromarray(arr, "RGBA")
+        logger.debug(f"{w=} {h=} {format=} {colorspace=}")
+        if not (0 < w <= 16384 and 0 < h <= 16384):
+            raise ValueError(f"invalid screencap header: {w=} {h=} {format=}")
+        return w, h, colorspace
+
+    def _wrap_screencap(self, pixels: np.ndarray, colorspace) -> cvimage.Image:
+        im = cvimage.fromarray(pixels, "RGBA")
         if colorspace == 2:
-            from imgreco.cms import p3_to_srgb_inplace
+            from imgreco.cms import convert_p3_screenshot
 
-            im = p3_to_srgb_inplace(im)
+            im = convert_p3_screenshot(im)
         return im
 
+    def _recv_screencap(self, sock) -> cvimage.Image:
+        """receive raw screencap output from socket, without intermediate copies"""
+        w, h, colorspace = self._parse_screencap_header(
+            recvexactly(sock, self._screencap_header_len)
+        )
+        # 像素数据直接写入最终的图像缓冲区
+        pixels = np.empty((h, w, 4), dtype=np.uint8)
+        try:
+            recvexactly_into(sock, pixels)
+        except EOFError:
+            raise ValueError("screencap short read")
+        if trailing := drain(sock):
+            logger.debug("discarded %d trailing bytes", trailing)
+        return self._wrap_screencap(pixels, colorspace)
+
+    def _recv_screencap_gzip(self, sock) -> cvimage.Image:
+        """receive gzip-compressed screencap output, decompressing while receiving"""
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        hdrlen = self._screencap_header_len
+        header = b""
+        colorspace = 0
+        pixels = None
+        flat = None
+        pos = 0
+        rcvbuf = np.empty(262144, dtype=np.uint8)
+        while True:
+            rcvlen = sock.recv_into(rcvbuf)
+            if rcvlen == 0:
+                chunk = decompressor.flush()
+            else:
+                chunk = decompressor.decompress(rcvbuf[:rcvlen])
+            if pixels is None and chunk:
+                header += chunk
+                if len(header) < hdrlen:
+                    continue
+                w, h, colorspace = self._parse_screencap_header(header[:hdrlen])
+                pixels = np.empty((h, w, 4), dtype=np.uint8)
+                flat = pixels.reshape(-1)
+                chunk = header[hdrlen:]
+                header = None
+            if chunk and flat is not None:
+                copylen = min(len(chunk), len(flat) - pos)
+                flat[pos : pos + copylen] = np.frombuffer(chunk, np.uint8, copylen)
+                pos += copylen
+            if rcvlen == 0 or decompressor.eof:
+                break
+        if pixels is None or pos != len(flat):
+            raise ValueError("screencap short read")
+        return self._wrap_screencap(pixels, colorspace)
+
     def _decode_screencap_png(self, pngdata):
         bio = io.BytesIO(pngdata)
         from PIL import Image as PILImage, ImageCms
@@ -283,10 +473,8 @@ class ShellScreenshotAdapter(ScreenshotProtocol):
         return cvimage.from_pil(img)
 
     def _screenshot_adb_raw(self):
-        sock = self.controller.adb.exec_stream("screencap")
-        data = recvall(sock, 8388608, True)
-        sock.close()
-        return self._decode_screencap(data)
+        with self.controller.adb.exec_stream("screencap") as sock:
+            return self._recv_screencap(sock)
 
     def _screenshot_adb_png(self):
         sock = self.controller.adb.exec_stream("screencap -p")
@@ -295,11 +483,8 @@ class ShellScreenshotAdapter(ScreenshotProtocol):
         return self._decode_screencap_png(data)
 
     def _screenshot_adb_compressed(self):
-        sock = self.controller.adb.exec_stream("screencap | gzip -1")
-        data = recvall(sock, 8388608, True)
-        sock.close()
-        data = zlib.decompress(data, zlib.MAX_WBITS | 16, 8388608)
-        return self._decode_screencap(data)
+        with self.controller.adb.exec_stream("screencap | gzip -1") as sock:
+            return self._recv_screencap_gzip(sock)
 
     def _screenshot_nc_connect(self):
         nc_command = self.controller.device_info.nc_command
@@ -310,8 +495,7 @@ class ShellScreenshotAdapter(ScreenshotProtocol):
             f"(echo {future.cookie.decode()}; screencap) | {nc_command} {nat_address} {rch.port}"
         ):
             with future.result(10) as sock:
-                data = recvall(sock, 8388608, True)
-        return self._decode_screencap(data)
+                return self._recv_screencap(sock)
 
     def _screenshot_nc_listen(self):
         address = self.controller.device_info.host_l2_reachable
@@ -321,8 +505,7 @@ class ShellScreenshotAdapter(ScreenshotProtocol):
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
                 sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 sock.connect((address, self._listen_port))
-                data = recvall(sock, 8388608, True)
-        return self._decode_screencap(data)
+                return self._recv_screencap(sock)
 
     def screenshot(self):
         return self._impl()
@@ -447,6 +630,8 @@ class ADBController(Controller):
 
         self._last_screenshot = None
         self._last_screenshot_expire = 0
+        self._last_signature_image = None
+        self._last_signature: Optional[FrameSignature] = None
 
         if (
             self.device_config.input_method == "aah-agent"
@@ -545,9 +730,17 @@ class ADBController(Controller):
                 self._last_screenshot_expire = t0 + (1 / rate_limit)
         return self._last_screenshot
 
+    def frame_signature(self, image: cvimage.Image) -> FrameSignature:
+        """signature of a screenshot, computed once per frame"""
+        if image is not self._last_signature_image:
+            self._last_signature = compute_signature(image)
+            self._last_signature_image = image
+        return self._last_signature
+
     def close(self):
         self.input.close()
         self._screenshot_adapter.close()
+        self.adb.close()
 
     def touch_swipe2(self, origin, movement, duration=None):
         """DEPRECATED: use input.touch_swipe() instead"""
@@ -10,6 +10,7 @@ import logging
 import random
 import socket
 import struct
+import sys
 import threading
 import time
 from contextlib import contextmanager
@@ -20,7 +21,7 @@ import lz4.block
 from .client import ADBDevice
 from ..types import EventAction, EventFlag
 
-from util.socketutil import recvexactly
+from util.socketutil import recvexactly, recvexactly_into
 from util import cvimage
 
 
@@ -53,6 +54,56 @@ class ScreenshotImage:
     capture_latency: float
 
 
+@dataclass
+class FramePoolStats:
+    frames: int = 0
+    bytes_received: int = 0
+    decompress_time: float = 0.0
+    copy_count: int = 0
+    buffers_allocated: int = 0
+    buffers_reused: int = 0
+
+
+class FramePool:
+    """
+    Preallocated frame buffers, recycled once no image refers to them.
+
+    Images handed out are views of the pooled buffer, a buffer is reused only after
+    all of its views are gone, so callers may keep screenshots as long as they want.
+    """
+
+    def __init__(self, size=2):
+        self.size = max(1, size)
+        self.stats = FramePoolStats()
+        self._buffers: list[np.ndarray] = []
+        self._next_evict = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, nbytes: int) -> np.ndarray:
+        with self._lock:
+            for i in range(len(self._buffers)):
+                # referenced only by the list and getrefcount argument: no live views
+                if (
+                    self._buffers[i].nbytes == nbytes
+                    and sys.getrefcount(self._buffers[i]) <= 2
+                ):
+                    self.stats.buffers_reused += 1
+                    return self._buffers[i]
+            buf = np.empty(nbytes, dtype=np.uint8)
+            self.stats.buffers_allocated += 1
+            if len(self._buffers) < self.size:
+                self._buffers.append(buf)
+            else:
+                # busy or stale buffer is left to its views (or the GC)
+                self._buffers[self._next_evict] = buf
+                self._next_evict = (self._next_evict + 1) % self.size
+            return buf
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+
+
 def _socket_iter_lines(sock: socket.socket):
     linebuf = io.BytesIO()
     buf = bytearray(4096)
@@ -83,6 +134,8 @@ class ControlAgentClient:
         self.stdio_stream = None
         self.control_stream = None
         self.data_stream = None
+        self.frame_pool = FramePool()
+        self._compressed_buf = None
 
         self.log_tag = f"aah-agent on {device}"
 
@@ -245,25 +298,72 @@ class ControlAgentClient:
         nanosecs = struct.unpack(">q", resp)[0]
         return nanosecs
 
+    def _recv_frame_payload(self, sock: socket.socket, rawsize: int, decompress_len):
+        """receive pixel data into a pooled buffer, returns the buffer"""
+        stats = self.frame_pool.stats
+        stats.bytes_received += rawsize
+        if decompress_len == 0:
+            return recvexactly_into(sock, self.frame_pool.acquire(rawsize))
+        # compressed data is consumed before returning, so one scratch buffer is enough
+        if self._compressed_buf is None or self._compressed_buf.nbytes < rawsize:
+            self._compressed_buf = np.empty(rawsize, dtype=np.uint8)
+        compressed = recvexactly_into(sock, self._compressed_buf[:rawsize])
+        t0 = time.perf_counter()
+        # lz4.block can't decompress into an existing buffer, use its bytearray in place
+        decompressed = lz4.block.decompress(
+            compressed, uncompressed_size=decompress_len, return_bytearray=True
+        )
+        stats.decompress_time += time.perf_counter() - t0
+        return np.frombuffer(decompressed, dtype=np.uint8)
+
+    def _request_frame(self, conn: SocketWithLock, payload: bytes):
+        sock = conn.socket
+        with conn.lock:
+            sock.sendall(b"SCAP" + struct.pack(">i", len(payload)) + payload)
+            response = recvexactly(sock, 8)
+            tresp = time.perf_counter()
+            token = response[:4]
+            payload_len = struct.unpack(">i", response[4:])[0]
+            if token == b"FAIL":
+                raise RuntimeError(
+                    recvexactly(sock, payload_len).decode("utf-8", "ignore")
+                )
+            elif token != b"OKAY":
+                raise RuntimeError(f"Unknown response: {token}")
+            assert payload_len >= 40
+            header = struct.unpack(">iiiiiqqi", recvexactly(sock, 40))
+            rawsize = payload_len - 40
+            if rawsize == 0:
+                return header, None, tresp
+            decompress_len = header[-1]
+            buf = self._recv_frame_payload(sock, rawsize, decompress_len)
+            return header, buf, tresp
+
+    @property
+    def frame_stats(self) -> FramePoolStats:
+        """statistics of screenshot transfers, see :class:`FramePoolStats`"""
+        return self.frame_pool.stats
+
     def screenshot(self, compress: bool = False, srgb: bool = False):
         """
         Fetch last rendered frame from device.
 
+        The returned image may share memory with the frame pool, a pooled buffer
+        is only reused after the image (and all views of it) is released.
+
         :param compress: whether to compress the image, may speed up transfer
         :param srgb:     whether to convert the image to sRGB
 
         :return: screenshot image, or `None` if no frame is available
         """
         if compress:
-            resp, tinit, tsend, tresp, tfullresp = self._send_command_with_metrics(
-                self.data_stream, b"SCAP", b"\x01\x00\x00\x00"
+            header, buf, tresp = self._request_frame(
+                self.data_stream, b"\x01\x00\x00\x00"
             )
         else:
-            resp, tinit, tsend, tresp, tfullresp = self._send_command_with_metrics(
-                self.data_stream, b"SCAP", b"\x00\x00\x00\x00"
+            header, buf, tresp = self._request_frame(
+                self.data_stream, b"\x00\x00\x00\x00"
             )
-        resplen = len(resp)
-        assert resplen >= 40
         (
             width,
             height,
@@ -273,26 +373,31 @@ class ControlAgentClient:
             ts,
             java_capture_latency,
             decompress_len,
-        ) = struct.unpack_from(">iiiiiqqi", resp, 0)
+        ) = header
         # print('colorspace:', color)
-        rawsize = resplen - 40
-        if rawsize == 0:
+        if buf is None:
             return None
-        buf = np.frombuffer(resp[40:], dtype=np.uint8)
-        if decompress_len != 0:
-            decompressed = lz4.block.decompress(
-                buf, uncompressed_size=decompress_len, return_bytearray=True
+        stats = self.frame_pool.stats
+        stats.frames += 1
+        if px == 4 and row == width * 4:
+            # tightly packed, use the received buffer as is
+            arr = buf[: height * row].reshape((height, width, 4))
+        else:
+            strided = np.lib.stride_tricks.as_strided(
+                buf, (height, width, 4), (row, px, 1)
+            )
+            arr = self.frame_pool.acquire(height * width * 4).reshape(
+                (height, width, 4)
             )
-            buf = np.frombuffer(decompressed, dtype=np.uint8)
-        arr = np.lib.stride_tricks.as_strided(buf, (height, width, 4), (row, px, 1))
-        arr = np.ascontiguousarray(arr)
+            np.copyto(arr, strided)
+            stats.copy_count += 1
 
         # offset = nanoTime - perf_counter_ns
         img = cvimage.fromarray(arr, "RGBA")
         if srgb and color == ScreenshotImage.COLORSPACE_DISPLAY_P3:
-            from imgreco.cms import p3_to_srgb_inplace
+            from imgreco.cms import convert_p3_screenshot
 
-            img = p3_to_srgb_inplace(img)
+            img = convert_p3_screenshot(img)
             color = ScreenshotImage.COLORSPACE_SRGB
         xfer_time = time.perf_counter() - tresp
         img.timestamp = ts / 1e9
@@ -407,6 +512,7 @@ class ControlAgentClient:
                 self.control_stream.close()
             if self.data_stream:
                 self.data_stream.close()
+            self.frame_pool.clear()
             self.closed = True
 
 
@@ -3,9 +3,12 @@ from typing import Optional
 
 import contextlib
 from functools import lru_cache
+import os
+import shlex
 import socket
 import struct
 import logging
+import threading
 import time
 
 import numpy as np
@@ -39,6 +42,21 @@ def _read_binlen_le(sock):
     return buf
 
 
+def _socket_alive(sock: socket.socket):
+    """check that an idle socket is neither closed by peer nor has unexpected data"""
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        sock.recv(1, socket.MSG_PEEK)
+        return False
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
 class ADBClientSession:
     def __init__(self, server=None, timeout=None):
         if server is None:
@@ -73,12 +91,157 @@ class ADBClientSession:
         return sock
 
 
+class ADBSessionPool:
+    """sessions with transport already selected, refilled in background"""
+
+    def __init__(self, device: ADBDevice, size=2):
+        self.device = device
+        self.size = size
+        self.idle: list[ADBClientSession] = []
+        self.lock = threading.Lock()
+        self.refilling = False
+        self.closed = False
+
+    def acquire(self) -> Optional[ADBClientSession]:
+        """returns an idle session, or None if none is available"""
+        session = None
+        with self.lock:
+            while self.idle:
+                candidate = self.idle.pop()
+                if _socket_alive(candidate.sock):
+                    session = candidate
+                    break
+                candidate.close()
+            if not self.refilling and not self.closed:
+                self.refilling = True
+                threading.Thread(
+                    target=self._refill, name="adb-session-pool", daemon=True
+                ).start()
+        return session
+
+    def _refill(self):
+        try:
+            while True:
+                with self.lock:
+                    if self.closed or len(self.idle) >= self.size:
+                        break
+                session = self.device.create_session()
+                with self.lock:
+                    if self.closed:
+                        session.close()
+                        break
+                    self.idle.append(session)
+        except Exception:
+            logger.debug("failed to refill session pool", exc_info=True)
+        finally:
+            with self.lock:
+                self.refilling = False
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            for session in self.idle:
+                session.close()
+            self.idle.clear()
+
+
+class ADBCommandChannel:
+    """
+    long-lived `exec:sh` session running commands one after another
+
+    each command runs in its own `sh -c` with stdin from /dev/null, and its
+    output is followed by a marker line carrying a per-command token and the
+    exit status, so commands can be pipelined over the same session.
+    """
+
+    MARKER = b"#adb-channel:"
+    # 等待命令输出的最长时间，超时后放弃该连接
+    TIMEOUT = 30
+
+    def __init__(self, device: ADBDevice):
+        self.device = device
+        self.sock: Optional[socket.socket] = None
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        self.sock = self.device.service("exec:sh").detach()
+        self.sock.settimeout(self.TIMEOUT)
+        self.buffer.clear()
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _format(self, cmd: str, token: bytes):
+        return b"sh -c %s </dev/null 2>&1; echo '%s%s:'$?\n" % (
+            shlex.quote(cmd).encode(),
+            self.MARKER,
+            token,
+        )
+
+    def _read_result(self, token: bytes) -> tuple[bytes, int]:
+        marker = self.MARKER + token + b":"
+        search_start = 0
+        while True:
+            idx = self.buffer.find(marker, search_start)
+            if idx >= 0:
+                end = self.buffer.find(b"\n", idx + len(marker))
+                if end >= 0:
+                    output = bytes(self.buffer[:idx])
+                    status = int(self.buffer[idx + len(marker) : end])
+                    del self.buffer[: end + 1]
+                    return output, status
+            else:
+                search_start = max(0, len(self.buffer) - len(marker))
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise EOFError("command channel closed")
+            self.buffer += chunk
+
+    def run_many(self, cmds) -> list[tuple[bytes, int]]:
+        """run commands in order, returns list of (output, exit status)"""
+        tokens = [os.urandom(8).hex().encode() for _ in cmds]
+        script = b"".join(self._format(cmd, token) for cmd, token in zip(cmds, tokens))
+        with self.lock:
+            if self.sock is not None and (self.buffer or not _socket_alive(self.sock)):
+                self._close()
+            if self.sock is None:
+                self._connect()
+            try:
+                self.sock.sendall(script)
+            except OSError:
+                # 连接已失效，命令未送达，重连后重发
+                self._close()
+                self._connect()
+                self.sock.sendall(script)
+            try:
+                return [self._read_result(token) for token in tokens]
+            except socket.timeout:
+                # 残留的输出会与下一条命令混在一起，只能丢弃整个连接
+                self._close()
+                raise TimeoutError("command channel timed out") from None
+            except:
+                self._close()
+                raise
+
+    def run(self, cmd: str) -> tuple[bytes, int]:
+        return self.run_many([cmd])[0]
+
+
 class ADBDevice:
     def __init__(
         self, serial: Optional[str] = None, server: Optional[ADBServer] = None
     ):
         self.serial = serial
         self.server = server or ADBServer.DEFAULT
+        self.session_pool = ADBSessionPool(self)
+        self.command_channel = ADBCommandChannel(self)
 
     def __repr__(self):
         return f"{self.__class__.__name__}({self.server!r}, serial={self.serial!r})"
@@ -110,18 +273,38 @@ class ADBDevice:
                     return self._create_session_retry(retry_count + 1)
             raise
 
-    def service(self, cmd: str):
-        """make a service request to adbd, consult ADB sources for available services"""
+    def _service_oneshot(self, cmd: str):
         session = self.create_session()
         session.service(cmd)
         return session
 
+    def service(self, cmd: str):
+        """make a service request to adbd, consult ADB sources for available services"""
+        session = self.session_pool.acquire()
+        if session is not None:
+            try:
+                return session.service(cmd)
+            except (RuntimeError, OSError):
+                # 池中的连接可能已被 ADB server 关闭
+                session.close()
+        return self._service_oneshot(cmd)
+
     def exec_stream(self, cmd=""):
         """run command in device, with stdout/stdin attached to the socket returned"""
         return self.service("exec:" + cmd).detach()
 
     def exec(self, cmd):
         """run command in device, returns stdout content after the command exits"""
+        if len(cmd) == 0:
+            raise ValueError("no command specified for blocking exec")
+        return self.command_channel.run(cmd)[0]
+
+    def exec_many(self, cmds) -> list[bytes]:
+        """run commands in order over one round-trip, returns stdout content of each"""
+        return [output for output, _ in self.command_channel.run_many(cmds)]
+
+    def exec_oneshot(self, cmd):
+        """exec() in a separate ADB session"""
         if len(cmd) == 0:
             raise ValueError("no command specified for blocking exec")
         sock = self.exec_stream(cmd)
@@ -129,6 +312,10 @@ class ADBDevice:
         sock.close()
         return data
 
+    def close(self):
+        self.command_channel.close()
+        self.session_pool.close()
+
     def shell_stream(self, cmd=""):
         """run command in device, with pty attached to the socket returned"""
         return self.service("shell:" + cmd).detach()
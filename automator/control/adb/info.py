@@ -78,21 +78,17 @@ class ADBControllerDeviceInfo(Schema):
         if controller.adb.serial.startswith(
             "emulator-"
         ) or controller.adb.serial.startswith("127.0.0.1:"):
-            board = controller.adb.exec("getprop ro.product.board")
+            board, disk_vendor, disk_model = controller.adb.exec_many(
+                [
+                    "getprop ro.product.board",
+                    "cat /sys/class/block/?da/device/vendor 2>/dev/null",
+                    "cat /sys/class/block/?da/device/model 2>/dev/null",
+                ]
+            )
             if b"goldfish" in board:
                 return "avd"
-            disk_vendor = (
-                controller.adb.exec(
-                    "cat /sys/class/block/?da/device/vendor 2>/dev/null"
-                )
-                .decode()
-                .strip()
-            )
-            disk_model = (
-                controller.adb.exec("cat /sys/class/block/?da/device/model 2>/dev/null")
-                .decode()
-                .strip()
-            )
+            disk_vendor = disk_vendor.decode().strip()
+            disk_model = disk_model.decode().strip()
             full_disk_model = f"{disk_vendor} {disk_model}".strip()
             if "VBOX" in full_disk_model:
                 return "vbox"
@@ -144,8 +140,10 @@ class ADBControllerDeviceInfo(Schema):
     def nc_command(self):
         candidates = ["nc", "busybox nc"]
         # TODO: push static busybox to device
-        for candidate in candidates:
-            response = self._controller.adb.exec(f"{candidate} 127.0.0.1 0")
+        responses = self._controller.adb.exec_many(
+            [f"{candidate} 127.0.0.1 0" for candidate in candidates]
+        )
+        for candidate, response in zip(candidates, responses):
             if response.startswith(b"nc: "):
                 # nc: port number too small: 0
                 # nc: connect: Connection refused
@@ -4,6 +4,7 @@ import enum
 
 if TYPE_CHECKING:
     from util import cvimage
+    from util.framesig import FrameSignature
 
 
 class EventAction(enum.IntEnum):
@@ -89,6 +90,12 @@ class Controller(Protocol):
     def screenshot(self) -> cvimage.Image:
         raise NotImplementedError
 
+    def frame_signature(self, image: cvimage.Image) -> FrameSignature:
+        """cheap signature of a screenshot for change detection"""
+        from util.framesig import compute_signature
+
+        return compute_signature(image)
+
     def close(self) -> None:
         pass
 
@@ -21,6 +21,7 @@ from .control.adb.client import get_config_adb_server
 from .control.ADBController import ADBController
 from .frontend import Frontend, DummyFrontend
 from .mixin import AddonMixin
+import imgreco.common
 
 
 class BaseAutomator(AddonMixin):
@@ -90,7 +91,10 @@ class BaseAutomator(AddonMixin):
         else:
             self._controller = None
             return old_controller
+        old_viewport = getattr(self, "_viewport", None)
         self._viewport: tuple[int, int] = self._controller.screenshot().size
+        if old_viewport is not None and old_viewport != self._viewport:
+            imgreco.common.roi_cache.invalidate(old_viewport)
         self.vw = self._viewport[0] / 100
         self.vh = self._viewport[1] / 100
         self.on_device_connected()
@@ -34,6 +34,8 @@ import time
 
 import numpy as np
 from util.cvimage import Image, Rect
+from automator.control.types import ControllerCapabilities
+from util.framesig import compute_signature
 import imgreco.common
 import imgreco.imgops
 import imgreco.resources
@@ -104,7 +106,9 @@ class AddonMixin(imgreco.common.RoiMatchingMixin):
             shooter = lambda: self.helper.control.screenshot(False)
         else:
             shooter = lambda: self.helper.control.screenshot(False).crop(crop)
+        control = self.helper.control
         prev_screenshot = shooter()
+        prev_signature = control.frame_signature(prev_screenshot)
         t0 = time.monotonic()
         ts = t0 + timeout
         n = 0
@@ -114,7 +118,11 @@ class AddonMixin(imgreco.common.RoiMatchingMixin):
             if check_delay > 0:
                 self.delay(check_delay, False, False)
             screenshot2 = shooter()
-            mse = imgreco.imgops.compare_mse(prev_screenshot, screenshot2)
+            signature2 = control.frame_signature(screenshot2)
+            mse = signature2.mse_lower_bound(prev_signature)
+            # 缩略图差异已足够大时画面必然在变化，无需计算全分辨率 MSE
+            if mse <= threshold:
+                mse = imgreco.imgops.compare_mse(prev_screenshot, screenshot2)
             if mse <= threshold:
                 n += 1
                 if n >= iteration:
@@ -122,6 +130,7 @@ class AddonMixin(imgreco.common.RoiMatchingMixin):
             else:
                 n = 0
             prev_screenshot = screenshot2
+            prev_signature = signature2
             if mse < minerr:
                 minerr = mse
             if not message_shown and t1 - t0 > 10:
@@ -140,16 +149,74 @@ class AddonMixin(imgreco.common.RoiMatchingMixin):
             (origin_x, origin_y), (move, max(250, move // 2)), randint(600, 900)
         )
 
+    def _frame_signature(self, screenshot: Image, rects=None):
+        if rects is None:
+            return self.helper.control.frame_signature(screenshot)
+        return compute_signature(screenshot, rects=rects)
+
+    def wait_for_frame_change(self, signature, timeout: Real = 0.5) -> Optional[Image]:
+        """
+        wait until the screen differs from signature, returns the new screenshot
+
+        only polls when screenshots are cheap (timestamped), otherwise sleeps for timeout
+        and returns None. signatures of regions are compared on the same regions.
+        """
+        control = self.helper.control
+        caps = getattr(control, "capabilities", ControllerCapabilities(0))
+        if ControllerCapabilities.SCREENSHOT_TIMESTAMP not in caps:
+            self.delay(timeout, False, False)
+            return None
+        t1 = time.monotonic() + timeout
+        screenshot = None
+        while (remaining := t1 - time.monotonic()) > 0:
+            self.delay(min(0.1, remaining), False, False)
+            screenshot = control.screenshot(False)
+            rects = signature.rects if signature is not None else None
+            if self._frame_signature(screenshot, rects).changed_from(signature):
+                break
+        return screenshot
+
+    def _poll_frames(self, timeout: Real, interval: Real = 0.5, rects=None):
+        """yields (screenshot, changed) until timeout, changed is False if the screen
+        (or the given regions of it) looks the same as the last changed frame"""
+        t0 = time.monotonic()
+        signature = None
+        screenshot = None
+        while time.monotonic() < t0 + timeout:
+            if screenshot is None:
+                screenshot = self._implicit_screenshot()
+            new_signature = self._frame_signature(screenshot, rects)
+            changed = new_signature.changed_from(signature)
+            if changed:
+                signature = new_signature
+            yield screenshot, changed
+            screenshot = self.wait_for_frame_change(signature, interval)
+
+    def _roi_rects(self, rois, fixed_position=None):
+        """regions that fixed-position ROIs are matched in, None if any ROI searches the
+        whole screen"""
+        rects = []
+        for roi in rois:
+            fixed = fixed_position
+            if fixed is None:
+                fixed = roi.matching_preference.get("fixed_position", True)
+            if not fixed or roi.bbox is None:
+                return None
+            rects.append(roi.bbox)
+        return rects
+
     def wait_for_roi(
         self, roi: RoiDef, timeout: Real = 10, **roi_matching_args: RoiMatchingArgs
     ) -> imgreco.common.RoiMatchingResult:
-        t0 = time.monotonic()
         result = imgreco.common.RoiMatchingResult.NoMatch
-        while time.monotonic() < t0 + timeout:
-            result = self.match_roi(roi, **roi_matching_args)
+        roi = self._ensure_roi(roi, roi_matching_args.get("mode", "RGB"))
+        rects = self._roi_rects([roi], roi_matching_args.get("fixed_position"))
+        for screenshot, changed in self._poll_frames(timeout, rects=rects):
+            # 画面未变化时沿用上次的识别结果
+            if changed:
+                result = self.match_roi(roi, screenshot=screenshot, **roi_matching_args)
             if result:
                 break
-            self.delay(0.5, False, False)
         return result
 
     def wait_and_tap_roi(
@@ -166,16 +233,18 @@ class AddonMixin(imgreco.common.RoiMatchingMixin):
         timeout: Real = 10,
         **roi_matching_args: RoiMatchingArgs,
     ) -> tuple[bool, dict[str, imgreco.common.RoiMatchingResult]]:
-        rois = [self._ensure_roi(roi) for roi in rois]
-        t0 = time.monotonic()
+        mode = roi_matching_args.get("mode", "RGB")
+        rois = [self._ensure_roi(roi, mode) for roi in rois]
         results = {roi.name: imgreco.common.RoiMatchingResult.NoMatch for roi in rois}
-        while time.monotonic() < t0 + timeout:
-            results = {
-                roi.name: self.match_roi(roi, **roi_matching_args) for roi in rois
-            }
+        rects = self._roi_rects(rois, roi_matching_args.get("fixed_position"))
+        for screenshot, changed in self._poll_frames(timeout, rects=rects):
+            # one screenshot per poll for all ROIs, skipped if the screen looks the same
+            if changed:
+                results = self.match_rois(
+                    rois, screenshot=screenshot, **roi_matching_args
+                )
             if any(results.values()):
                 return True, results
-            self.delay(0.5, False, False)
         return False, results
 
     def wait_for_all_roi(
@@ -184,20 +253,22 @@ class AddonMixin(imgreco.common.RoiMatchingMixin):
         timeout: Real = 10,
         **roi_matching_args: RoiMatchingArgs,
     ) -> tuple[bool, dict[str, imgreco.common.RoiMatchingResult]]:
-        rois = [self._ensure_roi(roi) for roi in rois]
-        t0 = time.monotonic()
+        mode = roi_matching_args.get("mode", "RGB")
+        rois = [self._ensure_roi(roi, mode) for roi in rois]
         results = {roi.name: imgreco.common.RoiMatchingResult.NoMatch for roi in rois}
-        while time.monotonic() < t0 + timeout:
-            results = {
-                roi.name: self.match_roi(roi, **roi_matching_args) for roi in rois
-            }
+        rects = self._roi_rects(rois, roi_matching_args.get("fixed_position"))
+        for screenshot, changed in self._poll_frames(timeout, rects=rects):
+            # one screenshot per poll for all ROIs, skipped if the screen looks the same
+            if changed:
+                results = self.match_rois(
+                    rois, screenshot=screenshot, **roi_matching_args
+                )
             if all(results.values()):
                 return True, results
-            self.delay(0.5, False, False)
         return False, results
 
     def screenshot(self, mode="BGR", cached=None) -> Image:
-        raw_screen = self.helper.control.screenshot(cached=cached).convert(mode)
+        raw_screen = self.helper.control.screenshot(cached=cached).cached_convert(mode)
         if not app.config.device.wait_for_slow_network:
             return raw_screen
         vw, vh = self.helper.vw, self.helper.vh
@@ -207,6 +278,8 @@ class AddonMixin(imgreco.common.RoiMatchingMixin):
 
         while "提交反馈" in ocr_for_single_line(roi.array):
             self.delay(0.5, False)
-            raw_screen = self.helper.control.screenshot(cached=False).convert(mode)
+            raw_screen = self.helper.control.screenshot(cached=False).cached_convert(
+                mode
+            )
             roi = raw_screen.crop(roi_rect)
         return raw_screen
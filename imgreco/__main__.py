@@ -3,7 +3,11 @@ import logging
 
 logging.basicConfig(level=logging.NOTSET)
 
-if len(sys.argv) > 1:
+if sys.argv[1:2] == ["replay"]:
+    from imgreco.trace import replay_main
+
+    sys.exit(replay_main(sys.argv[2:]))
+elif len(sys.argv) > 1:
     from util import cvimage as Image
     import imgreco
 
@@ -22,3 +26,4 @@ if len(sys.argv) > 1:
     print(obj(Image.open(sys.argv[-1])))
 else:
     print("usage: python -m imgreco module_name function_name image_file")
+    print("       python -m imgreco replay trace_directory")
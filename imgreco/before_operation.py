@@ -10,6 +10,7 @@ from . import imgops
 from . import minireco
 from . import resources
 from . import common
+from .trace import set_score, traced
 
 logger = get_logger(__name__)
 
@@ -45,6 +46,7 @@ def ocr_stage_id(img):
 
 
 @lru_cache(1)
+@traced
 def recognize(img):
     vw, vh = common.get_vwvh(img.size)
     context = common.ImageRoiMatchingContext(img)
@@ -58,6 +60,7 @@ def recognize(img):
     ]
     delegate_match = min(matches, key=lambda x: x.score)
     logger.logtext("best_match=%s" % delegate_match)
+    set_score(delegate_match.score)
     if delegate_match.score > 3251:
         # ASSUMPTION: 存在代理指挥按钮
         return None
@@ -1,21 +1,243 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from functools import lru_cache
+
+import numpy as np
+import PIL
+from PIL import Image as PILImage, ImageCms
+
+import app
 from util import cvimage
 from . import resources
-from PIL import ImageCms
 
-p3_profile = ImageCms.ImageCmsProfile(resources.open_file("DisplayP3.icm"))
+logger = logging.getLogger(__name__)
+
+with resources.open_file("DisplayP3.icm") as f:
+    p3_icc = f.read()
+p3_profile = ImageCms.ImageCmsProfile(io.BytesIO(p3_icc))
 srgb_profile = ImageCms.createProfile("sRGB")
 
 
-def p3_to_srgb_inplace(img: cvimage.Image):
-    pil_im, copied = img.to_pil2()
-    ImageCms.profileToProfile(pil_im, p3_profile, srgb_profile, inPlace=True)
-    if copied:
-        return cvimage.from_pil(pil_im)
+def _build_table(src_profile, dst_profile):
+    # 对全部 2^24 种颜色做一次 LittleCMS 变换，得到无需插值的查找表
+    cube = np.arange(1 << 24, dtype=np.uint32).view(np.uint8).reshape(4096, 4096, 4)
+    pil_im = PILImage.fromarray(np.ascontiguousarray(cube[..., :3]), "RGB")
+    ImageCms.profileToProfile(pil_im, src_profile, dst_profile, inPlace=True)
+    cube[..., :3] = np.asarray(pil_im)
+    cube[..., 3] = 0
+    return cube.view(np.uint32).reshape(-1)
+
+
+@lru_cache(maxsize=None)
+def get_p3_to_srgb_table() -> np.ndarray:
+    """
+    lookup table indexed by packed 0xBBGGRR, values are packed sRGB with zero alpha
+
+    built from the ICC profiles on first use and cached on disk.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(p3_icc)
+    digest.update(PIL.__version__.encode())
+    path = app.cache_path / ("cms-p3-srgb-%s.npy" % digest.hexdigest())
+    try:
+        table = np.load(path, mmap_mode="r")
+        if table.shape == (1 << 24,) and table.dtype == np.uint32:
+            return np.asarray(table)
+    except (OSError, ValueError):
+        pass
+    logger.debug("building Display P3 to sRGB lookup table")
+    table = _build_table(p3_profile, srgb_profile)
+    try:
+        os.makedirs(path.parent, exist_ok=True)
+        tmppath = path.with_name("%s.%d.tmp" % (path.name, os.getpid()))
+        with open(tmppath, "wb") as f:
+            np.save(f, table)
+        os.replace(tmppath, path)
+    except OSError:
+        logger.debug("failed to save lookup table", exc_info=True)
+    return table
+
+
+def p3_to_srgb(mat: np.ndarray, out=None) -> np.ndarray:
+    """convert RGB or RGBA uint8 array, alpha is kept as is, out must be C-contiguous"""
+    table = get_p3_to_srgb_table()
+    if out is None:
+        out = np.empty(mat.shape, np.uint8)
+    if mat.shape[-1] == 4:
+        px = np.ascontiguousarray(mat).view(np.uint32)[..., 0]
+        index = px & 0xFFFFFF
+        alpha = px & 0xFF000000
+        # out 可以就是 mat，此时 px 已经用完
+        result = out.view(np.uint32)[..., 0]
+        np.take(table, index, out=result)
+        result |= alpha
     else:
+        index = mat[..., 2].astype(np.uint32) << 16
+        index |= mat[..., 1].astype(np.uint32) << 8
+        index |= mat[..., 0]
+        result = np.take(table, index).view(np.uint8)
+        out[...] = result.reshape(*mat.shape[:-1], 4)[..., :3]
+    return out
+
+
+def p3_to_srgb_inplace(img: cvimage.Image):
+    mat = img.array
+    if mat.flags.writeable and mat.flags.c_contiguous:
+        p3_to_srgb(mat, out=mat)
+        img.invalidate_cache()
         return img
+    result = cvimage.Image(p3_to_srgb(mat), img.mode)
+    result.timestamp = img.timestamp
+    return result
+
+
+_deferred_modes = ("RGB", "RGBA", "BGR", "BGRA")
+
+
+def _reorder_channels(mat: np.ndarray, from_mode, to_mode):
+    """view (or copy) of mat with channels rearranged, missing alpha is opaque"""
+    if from_mode == to_mode:
+        return mat
+    index = [from_mode.index(c) if c in from_mode else None for c in to_mode]
+    if None in index:
+        result = np.empty((*mat.shape[:2], len(to_mode)), np.uint8)
+        for i, j in enumerate(index):
+            result[..., i] = 255 if j is None else mat[..., j]
+        return result
+    first, last = index[0], index[-1]
+    if index == list(range(first, last + 1)):
+        return mat[..., first : last + 1]
+    if index == list(range(first, last - 1, -1)):
+        return mat[..., first : (last - 1 if last > 0 else None) : -1]
+    return mat[..., index]
+
+
+class DeferredP3Image(cvimage.Image):
+    """
+    Display P3 image converted to sRGB on first access of its pixels
+
+    subviews and conversions between RGB, RGBA, BGR and BGRA stay deferred,
+    so only regions read by recognizers are converted. anything reading the
+    whole array (e.g. frame signatures in polling loops) converts the whole
+    frame once.
+    """
+
+    def __init__(self, source: np.ndarray, mode):
+        if mode not in _deferred_modes:
+            raise ValueError("unsupported mode %r" % mode)
+        self._lock = threading.Lock()
+        super().__init__(source, mode)
+
+    def _convert_source(self, source):
+        rgb_mode = "RGBA" if len(self.mode) == 4 else "RGB"
+        converted = p3_to_srgb(_reorder_channels(source, self.mode, rgb_mode))
+        return np.ascontiguousarray(_reorder_channels(converted, rgb_mode, self.mode))
+
+    @property
+    def _mat(self):
+        converted = self._converted
+        if converted is None:
+            with self._lock:
+                if self._converted is None:
+                    converted = self._convert_source(self._source)
+                    converted.flags.writeable = self._source.flags.writeable
+                    self._converted = converted
+                    # 释放源图像（可能是帧缓冲池中的缓冲区）
+                    self._source = None
+                converted = self._converted
+        return converted
+
+    @_mat.setter
+    def _mat(self, value):
+        with self._lock:
+            self._source = value
+            self._converted = None
+
+    def _pending_source(self):
+        """source pixels if not converted yet, otherwise None"""
+        with self._lock:
+            return self._source if self._converted is None else None
+
+    @property
+    def converted(self):
+        return self._converted is not None
+
+    def _derive(self, mat, mode):
+        result = DeferredP3Image(mat, mode)
+        result.timestamp = self.timestamp
+        return result
+
+    def _shape(self):
+        with self._lock:
+            return (self._source if self._converted is None else self._converted).shape
+
+    @property
+    def dtype(self):
+        return np.dtype(np.uint8)
+
+    @property
+    def width(self):
+        return self._shape()[1]
+
+    @property
+    def height(self):
+        return self._shape()[0]
+
+    @property
+    def size(self):
+        return tuple(self._shape()[1::-1])
+
+    def _readonly_view(self):
+        source = self._pending_source()
+        if source is None:
+            return super()._readonly_view()
+        return self._derive(source.view(), self.mode)
+
+    def _set_readonly(self):
+        with self._lock:
+            if self._converted is not None:
+                self._converted.flags.writeable = False
+            else:
+                self._source = self._source.view()
+                self._source.flags.writeable = False
+
+    def subview(self, rect):
+        source = None if rect is None else self._pending_source()
+        if source is None:
+            return super().subview(rect)
+        left, top, right, bottom = cvimage.rect_to_ltrb(rect)
+        return self._derive(source[top:bottom, left:right], self.mode)
+
+    def convert(self, mode=None, *args, **kwargs):
+        # 调整通道顺序、丢弃/补充 alpha 通道与颜色变换可交换
+        if mode in _deferred_modes and not args and not kwargs:
+            source = self._pending_source()
+            if source is not None:
+                if mode == self.mode:
+                    return self._derive(source.copy(), mode)
+                return self._derive(_reorder_channels(source, self.mode, mode), mode)
+        return super().convert(mode, *args, **kwargs)
+
+
+def p3_to_srgb_deferred(img: cvimage.Image):
+    """returns a DeferredP3Image, or converts in place if it can't be deferred"""
+    if img.mode not in _deferred_modes or img.dtype != np.uint8:
+        return p3_to_srgb_inplace(img)
+    result = DeferredP3Image(img.array, img.mode)
+    result.timestamp = img.timestamp
+    return result
+
+
+def convert_p3_screenshot(img: cvimage.Image):
+    if app.config.device.defer_color_conversion:
+        return p3_to_srgb_deferred(img)
+    return p3_to_srgb_inplace(img)
 
 
-# numpy is slower than ImageCms (LittleCMS)
+# matrix-based conversion, slower than the lookup table above
 
 
 # import numpy as np
@@ -2,10 +2,13 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
-    from typing import Any, ClassVar, Optional, Union, Literal
+    from typing import Any, ClassVar, Optional, Sequence, Union, Literal
 
+from collections import OrderedDict
 from dataclasses import dataclass, field
+from functools import cached_property
 from numbers import Real
+import threading
 import cv2
 import numpy as np
 import logging
@@ -14,6 +17,7 @@ from util import cvimage as Image
 from util.richlog import get_logger
 from . import imgops
 from . import resources
+from .trace import set_score, traced
 
 richlogger = get_logger(__name__)
 logger = logging.getLogger(__name__)
@@ -75,11 +79,11 @@ def get_setting_back_rect(viewport):
 
 def find_close_button(img):
     # raise NotImplementedError
-    scale = 1
-    if img.height != 720:
-        scale = img.height / 720
-        img = imgops.scale_to_height(img, 720)
-    righttopimg = img.crop((img.width // 2, 0, img.width, img.height // 2)).convert("L")
+    scale = img.height / 720
+    img = img.cached_scale_to_height(720)
+    righttopimg = img.cached_convert("L").subview(
+        (img.width // 2, 0, img.width, img.height // 2)
+    )
     template = resources.load_image_cached("common/closebutton.png", "L")
     mtresult = cv2.matchTemplate(
         np.asarray(righttopimg), np.asarray(template), cv2.TM_CCOEFF_NORMED
@@ -96,13 +100,16 @@ def check_dialog(img):
     # buttons = img.crop((0, 64.861*vh, 100.000*vw, 75.417*vh)).convert('RGB')
     oldheight = img.height
     img = (
-        img.resize((1280, 720), Image.BILINEAR).convert("RGB").crop((0, 360, 1280, 640))
+        img.cached_resize((1280, 720), Image.BILINEAR)
+        .cached_convert("RGB")
+        .subview((0, 360, 1280, 640))
     )
     yesno = resources.load_image_cached("common/dialog_2btn.png", "RGB")
     ok = resources.load_image_cached("common/dialog_1btn.png", "RGB")
     pt1, coef1 = imgops.match_template(img, yesno)
     pt2, coef2 = imgops.match_template(img, ok)
     # print(pt1, coef1, pt2, coef2)
+    set_score(max(coef1, coef2))
     if max(coef1, coef2) > 0.5:
         return (
             ("yesno", (pt1[1] + 360) / 720 * oldheight)
@@ -112,6 +119,7 @@ def check_dialog(img):
     return None, None
 
 
+@traced
 def recognize_dialog(img):
     dlgtype, _ = check_dialog(img)
     if dlgtype is None:
@@ -216,6 +224,128 @@ class RoiMatchingResult:
 RoiMatchingResult.NoMatch = RoiMatchingResult(None, 65025, 1, 0)
 
 
+class PreparedRoi:
+    """ROI localized to a viewport, with matching templates resized on first use"""
+
+    def __init__(self, roi: RegionOfInterest, crop_size=None):
+        self.roi = roi
+        if crop_size is not None:
+            self.crop_size = crop_size
+
+    @cached_property
+    def crop_size(self) -> tuple[int, int]:
+        left, top, right, bottom = (int(round(x)) for x in self.roi.bbox.ltrb)
+        return right - left, bottom - top
+
+    @cached_property
+    def fixed_position_size(self) -> tuple[int, int]:
+        # same rule as imgops.uniform_size(template, crop)
+        template = self.roi.template
+        if template.height < self.crop_size[1]:
+            return template.size
+        return self.crop_size
+
+    @cached_property
+    def fixed_position_template(self) -> Image.Image:
+        template = self.roi.template
+        if template.size != self.fixed_position_size:
+            template = template.resize(self.fixed_position_size, Image.BILINEAR)
+        return template
+
+    @cached_property
+    def fixed_position_mask(self) -> Optional[Image.Image]:
+        if self.roi.mask is None:
+            return None
+        return self.roi.mask.resize(self.fixed_position_size)
+
+    @cached_property
+    def fixed_position_template_f32(self) -> np.ndarray:
+        return self.fixed_position_template.array.astype(np.float32)
+
+    @cached_property
+    def fixed_position_mask_zero(self) -> Optional[np.ndarray]:
+        if self.fixed_position_mask is None:
+            return None
+        return self.fixed_position_mask.array == 0
+
+    @cached_property
+    def scaled_template(self) -> Image.Image:
+        return self.roi.template.resize((self.roi.bbox.width, self.roi.bbox.height))
+
+    @cached_property
+    def scaled_mask(self) -> Optional[Image.Image]:
+        if self.roi.mask is None:
+            return None
+        return self.roi.mask.resize(self.scaled_template.size)
+
+    def fit_crop(self, compare: Image.Image) -> Image.Image:
+        if compare.size != self.fixed_position_size:
+            compare = compare.resize(self.fixed_position_size, Image.BILINEAR)
+        return compare
+
+    def compare_mse(self, compare: Image.Image) -> float:
+        diff = compare.array.astype(np.float32)
+        diff -= self.fixed_position_template_f32
+        if self.fixed_position_mask_zero is not None:
+            diff[self.fixed_position_mask_zero] = 0
+        return np.mean(diff * diff)
+
+
+class RoiCache:
+    """bounded LRU cache of localized ROIs, keyed by (name, mode, viewport)"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._cache: OrderedDict[tuple, PreparedRoi] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            prepared = self._cache.get(key)
+            if prepared is not None:
+                self._cache.move_to_end(key)
+            return prepared
+
+    def _put(self, key, prepared):
+        with self._lock:
+            self._cache[key] = prepared
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def get(self, name: str, mode: str, viewport: tuple[int, int], localize):
+        key = (name, mode, tuple(viewport))
+        prepared = self._get(key)
+        if prepared is None:
+            roi = localize(resources.load_roi_cached(name, mode))
+            prepared = PreparedRoi(roi)
+            self._put(key, prepared)
+        return prepared
+
+    def prepare(
+        self, roi: RegionOfInterest, mode: str, viewport: tuple[int, int], localize
+    ):
+        key = (roi.name, mode, tuple(viewport))
+        prepared = self._get(key)
+        if prepared is not None and prepared.roi.template is roi.template:
+            return prepared
+        # ad-hoc ROI that is not backed by resources, prepare without caching
+        return PreparedRoi(localize(roi))
+
+    def invalidate(self, viewport: Optional[tuple[int, int]] = None):
+        """drop cached ROIs for given viewport, or all ROIs if viewport is None"""
+        with self._lock:
+            if viewport is None:
+                self._cache.clear()
+            else:
+                viewport = tuple(viewport)
+                for key in [k for k in self._cache if k[2] == viewport]:
+                    del self._cache[key]
+
+
+roi_cache = RoiCache()
+
+
 class RoiMatchingMixin:
     viewport: tuple[int, int]
 
@@ -223,19 +353,21 @@ class RoiMatchingMixin:
         raise NotImplementedError()
 
     def load_roi(self, name: str, mode: str = "RGB") -> RegionOfInterest:
-        roi = resources.load_roi(name, mode)
-        return self._localize_roi(roi)
+        return self._prepare_roi(name, mode).roi
 
     def _localize_roi(self, roi: RegionOfInterest):
         return roi.with_target_viewport(*self.viewport)
 
+    def _prepare_roi(self, roidef: Union[str, RegionOfInterest], mode) -> PreparedRoi:
+        if isinstance(roidef, str):
+            return roi_cache.get(roidef, mode, self.viewport, self._localize_roi)
+        else:
+            return roi_cache.prepare(roidef, mode, self.viewport, self._localize_roi)
+
     def _ensure_roi(
         self, roidef: Union[str, RegionOfInterest], mode
     ) -> RegionOfInterest:
-        if isinstance(roidef, str):
-            return self.load_roi(roidef, mode)
-        else:
-            return self._localize_roi(roidef)
+        return self._prepare_roi(roidef, mode).roi
 
     def match_roi(
         self,
@@ -247,7 +379,8 @@ class RoiMatchingMixin:
         screenshot=None,
         matching_mask=None,
     ) -> RoiMatchingResult:
-        roi = self._ensure_roi(roi, mode)
+        prepared = self._prepare_roi(roi, mode)
+        roi = prepared.roi
         if screenshot is None:
             screenshot = self._implicit_screenshot()
         if screenshot.mode != mode:
@@ -261,13 +394,17 @@ class RoiMatchingMixin:
             threshold = roi.matching_preference.get("threshold", None)
         if fixed_position:
             result.bbox = roi.bbox
-            compare = screenshot.crop(roi.bbox)
-            template, compare = imgops.uniform_size(roi.template, compare)
-            mask = roi.mask.resize(template.size) if roi.mask is not None else None
+            compare = screenshot.subview(roi.bbox)
+            if compare.size != prepared.crop_size:
+                # screenshot does not match the viewport, prepare for this crop only
+                prepared = PreparedRoi(roi, compare.size)
+            compare = prepared.fit_crop(compare)
+            template = prepared.fixed_position_template
+            mask = prepared.fixed_position_mask
             if method is None:
                 method = "mse"
             if method == "mse":
-                result.score = imgops.compare_mse(template, compare, mask)
+                result.score = prepared.compare_mse(compare)
                 result.optimal_score = 0
                 result.threshold = threshold if threshold is not None else 650
             elif method == "template_matching" or method == "ccoeff":
@@ -299,17 +436,13 @@ class RoiMatchingMixin:
                     cv_method = cv2.TM_CCOEFF_NORMED
                     result.optimal_score = 1
                     result.threshold = threshold if threshold is not None else 0.8
-                scaled_template = roi.template.resize((roi.bbox.width, roi.bbox.height))
-                mask = (
-                    roi.mask.resize(scaled_template.size)
-                    if roi.mask is not None
-                    else None
-                )
+                scaled_template = prepared.scaled_template
+                mask = prepared.scaled_mask
                 center, score = imgops.match_template(
                     screenshot,
                     scaled_template,
                     method=cv_method,
-                    template_mask=mask.array,
+                    template_mask=mask.array if mask is not None else None,
                 )
                 point = (
                     center[0] - scaled_template.width / 2,
@@ -338,8 +471,30 @@ class RoiMatchingMixin:
                 )
         uselogger = getattr(self, "logger", logger)
         uselogger.debug("%r", result)
+        set_score(result.score)
         return result
 
+    def match_rois(
+        self,
+        rois: Sequence[Union[str, RegionOfInterest]],
+        mode="RGB",
+        screenshot=None,
+        **roi_matching_args,
+    ) -> dict[str, RoiMatchingResult]:
+        """match multiple ROIs against a single screenshot, results keyed by ROI name"""
+        if screenshot is None:
+            screenshot = self._implicit_screenshot()
+        # 所有 ROI 共用一次截图和一次颜色模式转换
+        if screenshot.mode != mode:
+            screenshot = screenshot.convert(mode)
+        results = {}
+        for roi in rois:
+            result = self.match_roi(
+                roi, mode=mode, screenshot=screenshot, **roi_matching_args
+            )
+            results[result.roi_name] = result
+        return results
+
 
 class ImageRoiMatchingContext(RoiMatchingMixin):
     def __init__(self, img: Image.Image):
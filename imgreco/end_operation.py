@@ -14,6 +14,7 @@ from . import item
 from . import minireco
 from . import resources
 from . import common
+from .trace import traced
 
 logger = get_logger(__name__)
 
@@ -67,33 +68,51 @@ def tell_group(
         session.low_confidence = True
 
     if groupname == "Lucky Drops":
-        return (
-            groupname,
-            [
-                item.RecognizedItem(
-                    item_id="furni", name="(Furniture)", quantity=1, item_type="FURN"
-                )
-            ],
-        )
+        return (groupname, [])
 
     vw, vh = session.vw, session.vh
     itemwidth = 20.370 * vh
     itemcount = roundint(groupimg.width / itemwidth)
     logger.logtext("group has %d items" % itemcount)
-    result = []
+    itemimgs = []
     for i in range(itemcount):
         itemimg = groupimg.crop(
             (itemwidth * i, 0.000 * vh, itemwidth * (i + 1), 18.981 * vh)
         )
         # x1, _, x2, _ = (0.093*vh, 0.000*vh, 19.074*vh, 18.981*vh)
         itemimg = itemimg.crop((0.093 * vh, 0, 19.074 * vh, itemimg.height))
-        recognized_item = item.tell_item(
-            itemimg, with_quantity=True, learn_unrecognized=session.learn_unrecognized
+        itemimgs.append(itemimg)
+    return (groupname, itemimgs)
+
+
+def tell_groups_items(groups, session):
+    """
+    recognize items of all (groupname, itemimgs) groups with one tell_items call
+
+    returns list of (groupname, recognized items) in group order
+    """
+    allimgs = [itemimg for _, itemimgs in groups for itemimg in itemimgs]
+    recognized = []
+    if allimgs:
+        recognized = item.tell_items(
+            allimgs, with_quantity=True, learn_unrecognized=session.learn_unrecognized
         )
-        if recognized_item.low_confidence:
-            session.low_confidence = True
-        result.append(recognized_item)
-    return (groupname, result)
+    if any(recognized_item.low_confidence for recognized_item in recognized):
+        session.low_confidence = True
+    result = []
+    pos = 0
+    for groupname, itemimgs in groups:
+        if groupname == "Lucky Drops":
+            groupitems = [
+                item.RecognizedItem(
+                    item_id="furni", name="(Furniture)", quantity=1, item_type="FURN"
+                )
+            ]
+        else:
+            groupitems = recognized[pos : pos + len(itemimgs)]
+        pos += len(itemimgs)
+        result.append((groupname, groupitems))
+    return result
 
 
 def tell_group_ep10(
@@ -114,20 +133,13 @@ def tell_group_ep10(
         session.low_confidence = True
 
     if groupname == "Lucky Drops":
-        return (
-            groupname,
-            [
-                item.RecognizedItem(
-                    item_id="furni", name="(Furniture)", quantity=1, item_type="FURN"
-                )
-            ],
-        )
+        return (groupname, [])
 
     vw, vh = session.vw, session.vh
     itemwidth = 19.167 * vh
     itemcount = roundint(groupimg.width / itemwidth)
     logger.logtext("group has %d items" % itemcount)
-    result = []
+    itemimgs = []
     for i in range(itemcount):
         itemimg = groupimg.subview(
             (itemwidth * i, 0.000 * vh, itemwidth * (i + 1), bartop)
@@ -144,13 +156,8 @@ def tell_group_ep10(
                 center_y + itembox_radius + 1,
             )
         )
-        recognized_item = item.tell_item(
-            itemimg, with_quantity=True, learn_unrecognized=session.learn_unrecognized
-        )
-        if recognized_item.low_confidence:
-            session.low_confidence = True
-        result.append(recognized_item)
-    return (groupname, result)
+        itemimgs.append(itemimg)
+    return (groupname, itemimgs)
 
 
 def tell_group_name_alt(img, session):
@@ -278,6 +285,7 @@ def check_level_up_popup(img):
     return minireco.check_charseq(lvl_up_text, "Level up")
 
 
+@traced
 def check_end_operation(style, friendship, img):
     if style == "interlocking":
         if friendship:
@@ -362,6 +370,7 @@ class EndOperationResult:
     low_confidence: bool = False
 
 
+@traced
 def recognize(style, im, learn_unrecognized_item=False) -> EndOperationResult:
     if style in {"legacy", "ep10", "sof"}:
         return recognize_ep10(im, learn_unrecognized_item)
@@ -432,17 +441,19 @@ def recognize_legacy(im, learn_unrecognized_item):
     logger.logtext(repr(finalgroups))
 
     imggroups = [items.crop((x1, 0, x2, items.height)) for x1, x2 in finalgroups]
-    items = []
 
     session = RecognizeSession()
     session.vw = vw
     session.vh = vh
     session.learn_unrecognized = learn_unrecognized_item
 
+    groups = []
     for group in imggroups:
         groupresult = tell_group(group, session, linetop, linebottom)
         session.recognized_groups.append(groupresult[0])
-        items.append(groupresult)
+        groups.append(groupresult)
+    # 所有分组的物品合并为一次识别
+    items = tell_groups_items(groups, session)
 
     t1 = time.monotonic()
     if session.low_confidence:
@@ -520,19 +531,21 @@ def recognize_ep10(im: Image.Image, learn_unrecognized_item=False):
     logger.logtext(repr(finalgroups))
 
     imggroups = [items.crop((x1, 0, x2, items.height)) for x1, x2 in finalgroups]
-    items = []
 
     session = RecognizeSession()
     session.vw = vw
     session.vh = vh
     session.learn_unrecognized = learn_unrecognized_item
 
+    groups = []
     for group in imggroups:
         groupresult = tell_group_ep10(
             group, session, linetop - 71.111 * vh, linebottom - 71.111 * vh
         )
         session.recognized_groups.append(groupresult[0])
-        items.append(groupresult)
+        groups.append(groupresult)
+    # 所有分组的物品合并为一次识别
+    items = tell_groups_items(groups, session)
 
     t1 = time.monotonic()
     if session.low_confidence:
@@ -593,16 +606,18 @@ def recognize_interlocking(im):
     logger.logtext(repr(finalgroups))
 
     imggroups = [items.crop((x1, 0, x2, items.height)) for x1, x2 in finalgroups]
-    items = []
 
     session = RecognizeSession()
     session.vw = vw
     session.vh = vh
 
+    groups = []
     for group in imggroups:
         groupresult = tell_group(group, session, linetop, linebottom)
         session.recognized_groups.append(groupresult[0])
-        items.append(groupresult)
+        groups.append(groupresult)
+    # 所有分组的物品合并为一次识别
+    items = tell_groups_items(groups, session)
 
     t1 = time.monotonic()
     if session.low_confidence:
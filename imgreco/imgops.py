@@ -4,12 +4,19 @@ from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from typing import Union
 
+from collections import OrderedDict
 from dataclasses import dataclass
+import hashlib
+import logging
+import os
+import threading
 
 import cv2 as cv
 import numpy as np
 from util import cvimage as Image
 
+logger = logging.getLogger(__name__)
+
 
 def enhance_contrast(img, lower=90, upper=None):
     img = np.asarray(img, dtype=np.uint8)
@@ -195,48 +202,184 @@ class FeatureMatchingResult:
     M: np.ndarray = None
 
 
-def match_feature_orb(
+@dataclass
+class FeatureTemplate:
+    method: str
+    size: tuple[int, int]
+    keypoints: tuple
+    descriptors: np.ndarray
+
+
+_feature_tools = threading.local()
+_feature_template_cache: OrderedDict[tuple, FeatureTemplate] = OrderedDict()
+_feature_template_cache_lock = threading.Lock()
+
+
+def _get_feature_tools(method):
+    """returns (detector, descriptor, matcher), created once per thread"""
+    tools = getattr(_feature_tools, method, None)
+    if tools is None:
+        if method == "sift":
+            detector = cv.SIFT_create()
+            index_params = dict(algorithm=0, trees=5)  # algorithm=FLANN_INDEX_KDTREE
+            tools = (detector, detector, cv.FlannBasedMatcher(index_params, {}))
+        elif method == "orb":
+            index_params = dict(
+                algorithm=6, table_number=6, key_size=12, multi_probe_level=1
+            )
+            tools = (
+                cv.ORB_create(10000),
+                cv.xfeatures2d.BEBLID_create(0.75),
+                cv.FlannBasedMatcher(index_params, {}),
+            )
+        else:
+            raise ValueError("unsupported feature method %s" % method)
+        setattr(_feature_tools, method, tools)
+    return tools
+
+
+def _detect_and_compute(method, mat, mask=None):
+    detector, descriptor, _ = _get_feature_tools(method)
+    if detector is descriptor:
+        return detector.detectAndCompute(mat, mask)
+    kp = detector.detect(mat, mask)
+    return descriptor.compute(mat, kp)
+
+
+def _to_gray_mat(img):
+    if isinstance(img, np.ndarray):
+        return img
+    if img.mode == "L":
+        return img.array
+    return img.convert("L").array
+
+
+def _feature_cache_file(method, digest):
+    import app
+
+    return app.cache_path / "features" / f"{method}-{digest}.npz"
+
+
+def _save_feature_template(path, ft: FeatureTemplate):
+    kp = np.array(
+        [
+            (k.pt[0], k.pt[1], k.size, k.angle, k.response, k.octave, k.class_id)
+            for k in ft.keypoints
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 7)
+    descriptors = ft.descriptors if ft.descriptors is not None else np.empty(0)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmppath = path.with_suffix(".tmp.npz")
+    np.savez(tmppath, size=np.array(ft.size), keypoints=kp, descriptors=descriptors)
+    os.replace(tmppath, path)
+
+
+def _load_feature_template(path, method) -> FeatureTemplate:
+    with np.load(path) as data:
+        keypoints = tuple(
+            cv.KeyPoint(x, y, size, angle, response, int(octave), int(class_id))
+            for x, y, size, angle, response, octave, class_id in data["keypoints"]
+        )
+        descriptors = data["descriptors"]
+        if descriptors.size == 0:
+            descriptors = None
+        return FeatureTemplate(method, tuple(data["size"]), keypoints, descriptors)
+
+
+def get_feature_template(
+    templ, method="sift", mask=None, persist=False
+) -> FeatureTemplate:
+    """
+    keypoints and descriptors of a template, computed once per template content
+
+    :param persist: also store in on-disk cache, for templates from resources
+    """
+    mat = _to_gray_mat(templ)
+    digest = hashlib.blake2b(digest_size=16)
+    # 不同版本 OpenCV 的特征点不保证相同
+    digest.update(("%s %s %r" % (method, cv.__version__, mat.shape)).encode())
+    digest.update(np.ascontiguousarray(mat).data)
+    if mask is not None:
+        mask = np.asarray(mask)
+        digest.update(np.ascontiguousarray(mask).data)
+    key = (method, digest.hexdigest())
+    with _feature_template_cache_lock:
+        ft = _feature_template_cache.get(key)
+        if ft is not None:
+            _feature_template_cache.move_to_end(key)
+            return ft
+    ft = None
+    if persist:
+        cache_file = _feature_cache_file(*key)
+        try:
+            ft = _load_feature_template(cache_file, method)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.debug("failed to load %s", cache_file, exc_info=True)
+    if ft is None:
+        kp, des = _detect_and_compute(method, mat, mask)
+        ft = FeatureTemplate(method, (mat.shape[1], mat.shape[0]), tuple(kp), des)
+        if persist:
+            try:
+                _save_feature_template(cache_file, ft)
+            except Exception:
+                logger.debug("failed to save %s", cache_file, exc_info=True)
+    with _feature_template_cache_lock:
+        _feature_template_cache[key] = ft
+        while len(_feature_template_cache) > 64:
+            _feature_template_cache.popitem(last=False)
+    return ft
+
+
+def _match_feature_impl(
+    method,
     templ,
     haystack,
-    *,
-    min_match=10,
-    templ_mask=None,
-    haystack_mask=None,
-    limited_transform=False,
+    min_match,
+    templ_mask,
+    haystack_mask,
+    limited_transform,
+    haystack_roi,
 ) -> FeatureMatchingResult:
-    templ = np.asarray(templ.convert("L"))
-    haystack = np.asarray(haystack.convert("L"))
-
-    detector = cv.ORB_create(10000)
-    descriptor = cv.xfeatures2d.BEBLID_create(0.75)
-    # descriptor = detector
-    kp1 = detector.detect(templ, templ_mask)
-    kp2 = detector.detect(haystack, haystack_mask)
-    kp1, des1 = descriptor.compute(templ, kp1)
-    kp2, des2 = descriptor.compute(haystack, kp2)
-
-    index_params = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)
-    search_params = {}
-    matcher = cv.FlannBasedMatcher(index_params, search_params)
-    # matcher = cv.BFMatcher_create(cv.NORM_HAMMING)
-    matches = matcher.knnMatch(des1, des2, k=2)
+    if isinstance(templ, FeatureTemplate):
+        ft = templ
+    else:
+        ft = get_feature_template(templ, method, templ_mask)
+    haystack = _to_gray_mat(haystack)
+    offset = (0, 0)
+    if haystack_roi is not None:
+        # 只在指定区域内计算特征点，匹配结果换算回整张图的坐标
+        left, top, right, bottom = (int(round(x)) for x in haystack_roi)
+        haystack = haystack[top:bottom, left:right]
+        if haystack_mask is not None:
+            haystack_mask = np.asarray(haystack_mask)[top:bottom, left:right]
+        offset = (left, top)
+    kp1, des1 = ft.keypoints, ft.descriptors
+    kp2, des2 = _detect_and_compute(method, haystack, haystack_mask)
+
     good = []
-    for group in matches:
-        if len(group) >= 2 and group[0].distance < 0.75 * group[1].distance:
-            good.append(group[0])
+    if des1 is not None and des2 is not None and len(kp2) >= 2:
+        matcher = _get_feature_tools(method)[2]
+        matches = matcher.knnMatch(des1, des2, k=2)
+        for group in matches:
+            if len(group) >= 2 and group[0].distance < 0.75 * group[1].distance:
+                good.append(group[0])
 
     result = FeatureMatchingResult(len(kp1), len(good))
 
     if len(good) >= min_match:
         src_pts = np.float32([kp1[m.queryIdx].pt for m in good]).reshape(-1, 1, 2)
         dst_pts = np.float32([kp2[m.trainIdx].pt for m in good]).reshape(-1, 1, 2)
+        dst_pts += np.float32(offset)
 
         if limited_transform:
             M, _ = cv.estimateAffinePartial2D(src_pts, dst_pts)
         else:
             M, mask = cv.findHomography(src_pts, dst_pts, cv.RANSAC, 4.0)
 
-        h, w = templ.shape
+        w, h = ft.size
         pts = np.float32([[0, 0], [0, h - 1], [w - 1, h - 1], [w - 1, 0]]).reshape(
             -1, 1, 2
         )
@@ -250,7 +393,7 @@ def match_feature_orb(
     return result
 
 
-def match_feature(
+def match_feature_orb(
     templ,
     haystack,
     *,
@@ -258,50 +401,48 @@ def match_feature(
     templ_mask=None,
     haystack_mask=None,
     limited_transform=False,
+    haystack_roi=None,
 ) -> FeatureMatchingResult:
-    templ = np.asarray(templ.convert("L"))
-    haystack = np.asarray(haystack.convert("L"))
-
-    detector = cv.SIFT_create()
-    kp1, des1 = detector.detectAndCompute(templ, templ_mask)
-    kp2, des2 = detector.detectAndCompute(haystack, haystack_mask)
-
-    # index_params = dict(algorithm=6,
-    #                     table_number=6,
-    #                     key_size=12,
-    #                     multi_probe_level=2)
-    index_params = dict(algorithm=0, trees=5)  # algorithm=FLANN_INDEX_KDTREE
-    search_params = {}
-    flann = cv.FlannBasedMatcher(index_params, search_params)
-    matches = flann.knnMatch(des1, des2, k=2)
-    good = []
-    for group in matches:
-        if len(group) >= 2 and group[0].distance < 0.75 * group[1].distance:
-            good.append(group[0])
-
-    result = FeatureMatchingResult(len(kp1), len(good))
-
-    if len(good) >= min_match:
-        src_pts = np.float32([kp1[m.queryIdx].pt for m in good]).reshape(-1, 1, 2)
-        dst_pts = np.float32([kp2[m.trainIdx].pt for m in good]).reshape(-1, 1, 2)
+    """
+    :param templ:        template image, or FeatureTemplate from get_feature_template
+    :param haystack_roi: (left, top, right, bottom) to search in
+    """
+    return _match_feature_impl(
+        "orb",
+        templ,
+        haystack,
+        min_match,
+        templ_mask,
+        haystack_mask,
+        limited_transform,
+        haystack_roi,
+    )
 
-        if limited_transform:
-            M, _ = cv.estimateAffinePartial2D(src_pts, dst_pts)
-        else:
-            M, mask = cv.findHomography(src_pts, dst_pts, cv.RANSAC, 4.0)
 
-        h, w = templ.shape
-        pts = np.float32([[0, 0], [0, h - 1], [w - 1, h - 1], [w - 1, 0]]).reshape(
-            -1, 1, 2
-        )
-        if limited_transform:
-            dst = cv.transform(pts, M)
-        else:
-            dst = cv.perspectiveTransform(pts, M)
-        result.M = M
-        result.template_corners = dst.reshape(-1, 2)
-        # img2 = cv.polylines(haystack, [np.int32(dst)], True, 0, 2, cv.LINE_AA)
-    return result
+def match_feature(
+    templ,
+    haystack,
+    *,
+    min_match=10,
+    templ_mask=None,
+    haystack_mask=None,
+    limited_transform=False,
+    haystack_roi=None,
+) -> FeatureMatchingResult:
+    """
+    :param templ:        template image, or FeatureTemplate from get_feature_template
+    :param haystack_roi: (left, top, right, bottom) to search in
+    """
+    return _match_feature_impl(
+        "sift",
+        templ,
+        haystack,
+        min_match,
+        templ_mask,
+        haystack_mask,
+        limited_transform,
+        haystack_roi,
+    )
 
 
 def _find_homography_test(templ, haystack):
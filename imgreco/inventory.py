@@ -128,11 +128,10 @@ def convert_to_pil(cv_img):
 
 def get_all_item_in_screen(screen):
     imgs = get_all_item_img_in_screen(screen)
+    itemimgs = [Image.fromarray(item_img["item_img"], "BGR") for item_img in imgs]
     item_count_map = {}
-    for item_img in imgs:
-        itemimg = Image.fromarray(item_img["item_img"], "BGR")
+    for itemimg, itemreco in zip(itemimgs, item.tell_items(itemimgs)):
         logger.logimage(itemimg)
-        itemreco = item.tell_item(itemimg, with_quantity=True)
         logger.logtext("%r" % itemreco)
         if (
             itemreco.item_id is None
@@ -155,11 +154,10 @@ def get_all_item_details_in_screen(
     if exclude_item_types is None:
         exclude_item_types = {"ACTIVITY_ITEM"}
     imgs = get_all_item_img_in_screen(screen)
+    itemimgs = [Image.fromarray(item_img["item_img"], "BGR") for item_img in imgs]
     res = []
-    for item_img in imgs:
-        itemimg = Image.fromarray(item_img["item_img"], "BGR")
+    for item_img, itemimg, itemreco in zip(imgs, itemimgs, item.tell_items(itemimgs)):
         logger.logimage(itemimg)
-        itemreco = item.tell_item(itemimg, with_quantity=True)
         logger.logtext("%r" % itemreco)
         if itemreco.item_id is None:
             continue
@@ -19,7 +19,7 @@ from . import imgops
 from . import minireco
 from . import resources
 from . import common
-
+from .trace import set_score, traced
 
 logger = logging.getLogger(__name__)
 
@@ -36,19 +36,39 @@ def crop_item_middle_img(cv_item_img):
 
 
 def predict_item_dnn(cv_img, box_size=137):
-    cv_img = cv2.resize(cv_img, (box_size, box_size))
-    mid_img = crop_item_middle_img(cv_img)
+    return predict_items_dnn([cv_img], box_size)[0]
+
+
+def predict_items_dnn(cv_imgs, box_size=137):
+    if not cv_imgs:
+        return []
     from .itemdb import load_net, dnn_items_by_class
 
-    sess = load_net()
-    input_name = sess.get_inputs()[0].name
-    mid_img = np.moveaxis(mid_img, -1, 0)
-    out = sess.run(None, {input_name: [mid_img.astype(np.float32)]})[0]
+    mid_imgs = []
+    for cv_img in cv_imgs:
+        cv_img = cv2.resize(cv_img, (box_size, box_size))
+        mid_imgs.append(np.moveaxis(crop_item_middle_img(cv_img), -1, 0))
+    # NCHW batch for all items
+    blob = np.stack(mid_imgs).astype(np.float32)
 
-    out = out.flatten()
-    probs = common.softmax(out)
-    classId = np.argmax(out)
-    return probs[classId], dnn_items_by_class[classId]
+    sess = load_net()
+    net_input = sess.get_inputs()[0]
+    if net_input.shape[0] == 1:
+        # model exported with a fixed batch size
+        outs = [
+            sess.run(None, {net_input.name: blob[i : i + 1]})[0]
+            for i in range(len(blob))
+        ]
+        out = np.concatenate(outs)
+    else:
+        out = sess.run(None, {net_input.name: blob})[0]
+
+    result = []
+    for scores in out.reshape(len(blob), -1):
+        probs = common.softmax(scores)
+        classId = np.argmax(scores)
+        result.append((probs[classId], dnn_items_by_class[classId]))
+    return result
 
 
 @dataclass_json
@@ -87,48 +107,95 @@ def all_known_items():
 
 
 def get_quantity(itemimg):
-    richlogger = get_logger(__name__)
+    return get_quantities([itemimg])[0]
+
+
+def _prepare_quantity_image(itemimg):
     numimg = imgops.scalecrop(itemimg, 0.39, 0.71, 0.82, 0.855).convert("L")
     numimg = imgops.crop_blackedge2(numimg, 120)
-    if numimg is not None:
-        numimg = imgops.clear_background(numimg, 120)
-        numimg4legacy = numimg
-        numimg = imgops.pad(numimg, 8, 0)
-        numimg = imgops.invert_color(numimg)
-        richlogger.logimage(numimg)
-        from .ocr import acquire_engine_global_cached
+    if numimg is None:
+        return None, None
+    numimg = imgops.clear_background(numimg, 120)
+    numimg4legacy = numimg
+    numimg = imgops.pad(numimg, 8, 0)
+    numimg = imgops.invert_color(numimg)
+    return numimg, numimg4legacy
 
-        eng = acquire_engine_global_cached("en-us")
-        from imgreco.ocr import OcrHint
 
-        result = eng.recognize(
-            numimg,
+def _parse_quantity(qty_text, numimg4legacy, richlogger):
+    try:
+        try:
+            qty_base = float(qty_text.replace(" ", "").replace("K", ""))
+        except:
+            from . import itemdb
+
+            qty_minireco, score = itemdb.num_recognizer.recognize2(
+                numimg4legacy, subset="0123456789.K"
+            )
+            richlogger.logtext(f"{qty_minireco=}, {score=}")
+            if score > 0.2:
+                qty_text = qty_minireco
+                qty_base = float(qty_text.replace("K", ""))
+        qty_scale = 1000 if "K" in qty_text else 1
+        return int(qty_base * qty_scale)
+    except:
+        return None
+
+
+def get_quantities(itemimgs):
+    """recognize quantities of all items on a screen with one batched OCR request"""
+    richlogger = get_logger(__name__)
+    prepared = [_prepare_quantity_image(itemimg) for itemimg in itemimgs]
+    numimgs = [numimg for numimg, _ in prepared if numimg is not None]
+    for numimg in numimgs:
+        richlogger.logimage(numimg)
+    from .ocr import acquire_engine_global_cached, OcrHint
+
+    eng = acquire_engine_global_cached("en-us")
+    ocr_results = iter(
+        eng.recognize_many(
+            numimgs,
             char_whitelist="0123456789.K",
             tessedit_pageseg_mode="13",
             hints=[OcrHint.SINGLE_LINE],
         )
-        qty_text = result.text
+        if numimgs
+        else []
+    )
+    quantities = []
+    for numimg, numimg4legacy in prepared:
+        if numimg is None:
+            quantities.append(None)
+            continue
+        qty_text = next(ocr_results).text
         richlogger.logtext(f"{qty_text=}")
-        try:
-            try:
-                qty_base = float(qty_text.replace(" ", "").replace("K", ""))
-            except:
-                from . import itemdb
-
-                qty_minireco, score = itemdb.num_recognizer.recognize2(
-                    numimg4legacy, subset="0123456789.K"
-                )
-                richlogger.logtext(f"{qty_minireco=}, {score=}")
-                if score > 0.2:
-                    qty_text = qty_minireco
-                    qty_base = float(qty_text.replace("K", ""))
-            qty_scale = 1000 if "K" in qty_text else 1
-            return int(qty_base * qty_scale)
-        except:
-            return None
+        quantities.append(_parse_quantity(qty_text, numimg4legacy, richlogger))
+    return quantities
 
 
 def tell_item(itemimg, with_quantity=True, learn_unrecognized=False) -> RecognizedItem:
+    return tell_items([itemimg], with_quantity, learn_unrecognized)[0]
+
+
+@traced
+def tell_items(
+    itemimgs, with_quantity=True, learn_unrecognized=False
+) -> list[RecognizedItem]:
+    predictions = predict_items_dnn([x.convert("BGR").array for x in itemimgs])
+    set_score([prob for prob, _ in predictions])
+    if with_quantity:
+        quantities = get_quantities(itemimgs)
+    else:
+        quantities = [None] * len(itemimgs)
+    return [
+        _tell_item_with_prediction(itemimg, prob, dnnitem, quantity, learn_unrecognized)
+        for itemimg, (prob, dnnitem), quantity in zip(itemimgs, predictions, quantities)
+    ]
+
+
+def _tell_item_with_prediction(
+    itemimg, prob, dnnitem, quantity, learn_unrecognized
+) -> RecognizedItem:
     richlogger = get_logger(__name__)
     richlogger.logimage(itemimg)
     from . import itemdb
@@ -137,11 +204,7 @@ def tell_item(itemimg, with_quantity=True, learn_unrecognized=False) -> Recogniz
     # print(l/itemimg.width, t/itemimg.height, r/itemimg.width, b/itemimg.height)
     # numimg = itemimg.crop(scaledwh(80, 146, 90, 28)).convert('L')
     low_confidence = False
-    quantity = None
-    if with_quantity:
-        quantity = get_quantity(itemimg)
 
-    prob, dnnitem = predict_item_dnn(itemimg.convert("BGR").array)
     item_id = dnnitem.item_id
     name = dnnitem.item_name
     item_type = dnnitem.item_type
@@ -151,15 +214,11 @@ def tell_item(itemimg, with_quantity=True, learn_unrecognized=False) -> Recogniz
         img4reco = np.array(itemimg.resize((48, 48), Image.BILINEAR).convert("RGB"))
         img4reco[itemdb.itemmask] = 0
 
-        scores = []
-        for name, templ in itemdb.itemmats.items():
-            scores.append((name, imgops.compare_mse(img4reco, templ)))
-
-        scores.sort(key=lambda x: x[1])
-        itemname, score = scores[0]
+        names, scores = itemdb.rank_itemmats(img4reco)
+        itemname, score = names[0], scores[0]
         # maxmatch = max(scores, key=lambda x: x[1])
-        richlogger.logtext(repr(scores[:5]))
-        diffs = np.diff([a[1] for a in scores])
+        richlogger.logtext(repr(list(zip(names[:5], scores[:5]))))
+        diffs = np.diff(scores)
         item_type = None
         if score < 800 and np.any(diffs > 600):
             richlogger.logtext("matched %s with mse %f" % (itemname, score))
@@ -173,15 +173,15 @@ def update_extra_items():
     ]
     extra_known_items = {}
     extra_itemmats = {}
-    for key, value in extra_files:
-        for name, index in extra_files:
-            img = resources.load_image(index, "RGB")
-            _update_mat_collection(extra_itemmats, name, img)
-        extra_known_items[key] = value
+    for name, index in extra_files:
+        img = resources.load_image(index, "RGB")
+        _update_mat_collection(extra_itemmats, name, img)
+        extra_known_items[name] = index
     global itemmats
     itemmats = {}
     itemmats.update(resources_itemmats)
     itemmats.update(extra_itemmats)
+    _update_itemmat_stack()
     global all_known_items
     all_known_items = {}
     all_known_items.update(resources_known_items)
@@ -192,6 +192,27 @@ def update_extra_items():
 update_extra_items.old_mtime = 0
 
 
+def _update_itemmat_stack():
+    global itemmat_names, itemmat_stack, itemmat_sqnorms
+    itemmat_names = list(itemmats.keys())
+    # (N, 48*48*3) pre-masked templates, for nearest-template search in one matmul
+    itemmat_stack = np.zeros((len(itemmat_names), 48 * 48 * 3), dtype=np.float32)
+    for i, name in enumerate(itemmat_names):
+        itemmat_stack[i] = itemmats[name].reshape(-1)
+    itemmat_sqnorms = np.einsum(
+        "ij,ij->i", itemmat_stack, itemmat_stack, dtype=np.float64
+    )
+
+
+def rank_itemmats(mat):
+    """returns names and MSE scores against a pre-masked 48x48 image, best first"""
+    query = np.asarray(mat, dtype=np.float32).reshape(-1)
+    sqdist = itemmat_sqnorms - 2 * (itemmat_stack @ query) + np.dot(query, query)
+    mse = np.maximum(sqdist, 0) / query.size
+    order = np.argsort(mse, kind="stable")
+    return [itemmat_names[i] for i in order], mse[order]
+
+
 def add_item(image) -> str:
     import os
     import time
@@ -7,10 +7,12 @@ from util.richlog import get_logger
 from . import imgops
 from . import resources
 from . import common
+from .trace import set_score, traced
 
 logger = get_logger(__name__)
 
 
+@traced
 def check_main(img):
     vw, vh = common.get_vwvh(img.size)
     gear1 = img.crop((3.148 * vh, 2.037 * vh, 9.907 * vh, 8.796 * vh)).convert("L")
@@ -20,9 +22,27 @@ def check_main(img):
     # result = np.corrcoef(np.asarray(gear1).flat, np.asarray(gear2).flat)[0, 1]
     logger.logimage(gear1)
     logger.logtext("ccoeff=%f" % result)
+    set_score(result)
     return result > 0.9
 
 
+def _match_main_feature(name, img, left=0, right=100):
+    """match a resource template within the horizontal range left..right (in vw)"""
+    templ = imgops.get_feature_template(
+        resources.load_image_cached(name, "L"), persist=True
+    )
+    vw, vh = common.get_vwvh(img)
+    roi = (left * vw, 0, right * vw, img.height)
+    result = imgops.match_feature(templ, img, haystack_roi=roi)
+    corners = result.template_corners
+    if corners is None or not (
+        roi[0] <= np.min(corners[:, 0]) and np.max(corners[:, 0]) <= roi[2]
+    ):
+        # 范围只是经验值，未在其中找到完整的模板时搜索整个画面
+        result = imgops.match_feature(templ, img)
+    return result
+
+
 def get_ballte_corners(img):
     """
     :returns: [0][1]
@@ -45,9 +65,7 @@ def get_ballte_corners(img):
             (64.693 * vw, 37.963 * vh),
         )
     else:
-        return imgops.match_feature(
-            resources.load_image_cached("main/terminal.png", "L"), img
-        ).template_corners
+        return _match_main_feature("main/terminal.png", img, left=40).template_corners
 
 
 def get_task_corners(img):
@@ -72,9 +90,7 @@ def get_task_corners(img):
             np.array((58.489 * vw, 89.167 * vh)),
         )
     else:
-        return imgops.match_feature(
-            resources.load_image_cached("main/quest.png", "L"), img
-        ).template_corners
+        return _match_main_feature("main/quest.png", img, left=40).template_corners
 
 
 # 以下几条用于访问好友基建
@@ -95,8 +111,8 @@ def get_friend_corners(img):
     else:
         return [
             x[0]
-            for x in imgops.match_feature(
-                resources.load_image_cached("main/friends.png", "L"), img
+            for x in _match_main_feature(
+                "main/friends.png", img, right=60
             ).template_corners
         ]
 
@@ -1,4 +1,5 @@
 import logging
+from functools import lru_cache
 
 import cv2 as cv
 import numpy as np
@@ -6,71 +7,210 @@ from util import cvimage as Image
 
 from . import imgops, common
 from . import resources
+from .trace import set_score, traced
 
 from resources.imgreco import map_vectors
 
 logger = logging.getLogger("imgreco.map")
 
 
-def recognize_map(img, partition):
-    logger.debug("recognizing in partition %s", partition)
-    anchors = map_vectors.map_anchors[partition]
-    scale = img.height / 720
-    img = imgops.scale_to_height(img.convert("RGB"), 720)
-    imgmat = np.asarray(img)
-    match_results = [
-        (
-            anchor,
-            *imgops.match_template(
-                imgmat,
-                resources.load_image_cached(
-                    "maps/%s/%s.png" % (partition, anchor), "RGB"
-                ),
-            ),
+# 全图搜索先在缩小的图像上粗定位，再在原尺寸上局部精确匹配
+PYRAMID_SCALE = 0.5
+REFINE_MARGIN = 4
+# 跟踪时的搜索窗口余量（720p 像素），另加上预测位移的一半
+SEARCH_MARGIN = (48, 24)
+MATCH_THRESHOLD = 0.9
+
+
+@lru_cache(maxsize=None)
+def _load_anchor(partition, anchor):
+    templ = np.asarray(
+        resources.load_image_cached("maps/%s/%s.png" % (partition, anchor), "RGB")
+    )
+    small = cv.resize(
+        templ, None, fx=PYRAMID_SCALE, fy=PYRAMID_SCALE, interpolation=cv.INTER_AREA
+    )
+    return templ, small
+
+
+def _match_in_window(imgmat, templ, center, margin, method=cv.TM_CCOEFF_NORMED):
+    """match template in a window around expected center, in full image coordinates"""
+    h, w = templ.shape[:2]
+    left = max(0, int(center[0] - w / 2 - margin[0]))
+    top = max(0, int(center[1] - h / 2 - margin[1]))
+    right = min(imgmat.shape[1], int(center[0] + w / 2 + margin[0]) + 1)
+    bottom = min(imgmat.shape[0], int(center[1] + h / 2 + margin[1]) + 1)
+    if right - left < w or bottom - top < h:
+        return None, -1.0
+    (x, y), score = imgops.match_template(
+        imgmat[top:bottom, left:right], templ, method=method
+    )
+    return (x + left, y + top), score
+
+
+def _locate_anchor(img, partition):
+    """full-frame search of all anchors in partition, returns (anchor, center, score)"""
+    imgmat = img.array
+    small_imgmat = img.cached_resize(
+        (img.width * PYRAMID_SCALE, img.height * PYRAMID_SCALE), Image.BOX
+    ).array
+    match_results = []
+    for anchor in map_vectors.map_anchors[partition]:
+        templ, small = _load_anchor(partition, anchor)
+        (x, y), _ = imgops.match_template(small_imgmat, small)
+        pos, score = _match_in_window(
+            imgmat,
+            templ,
+            (x / PYRAMID_SCALE, y / PYRAMID_SCALE),
+            (REFINE_MARGIN, REFINE_MARGIN),
         )
-        for anchor in anchors
-    ]
+        match_results.append((anchor, pos, score))
     logger.debug("anchor match results: %s", repr(match_results))
     use_anchor = max(match_results, key=lambda x: x[2])
-    if use_anchor[2] < 0.9:
-        return None
-    logger.debug("use anchor: %s", repr(use_anchor))
-    bias = (
-        np.asarray(use_anchor[1], dtype=np.int32)
-        - map_vectors.stage_maps[partition][use_anchor[0]]
-    )
-    logger.debug("bias: %s", bias)
-    result = {
-        name: (pos + bias) * scale
-        for name, pos in map_vectors.stage_maps[partition].items()
-    }
+    if use_anchor[2] < MATCH_THRESHOLD:
+        # 粗定位可能错过小目标，退回原尺寸全图匹配
+        match_results = [
+            (anchor, *imgops.match_template(imgmat, _load_anchor(partition, anchor)[0]))
+            for anchor in map_vectors.map_anchors[partition]
+        ]
+        logger.debug("full scale anchor match results: %s", repr(match_results))
+        use_anchor = max(match_results, key=lambda x: x[2])
+        if use_anchor[2] < MATCH_THRESHOLD:
+            return None
+    return use_anchor
+
+
+class MapTracker:
+    """
+    locates stages of a partition in successive screenshots
+
+    the anchor found last time is first searched around its position predicted
+    from swipes issued since, a full-frame search is done only on a miss.
+    """
+
+    def __init__(self, partition):
+        self.partition = partition
+        self.anchor = None
+        self.anchor_pos = None
+        self.pending_shift = np.zeros(2)
+
+    def notify_swipe(self, movement):
+        """record a swipe (in screen pixels) issued after last recognize()"""
+        self.pending_shift += movement
+
+    def recognize(self, img):
+        logger.debug("recognizing in partition %s", self.partition)
+        scale = img.height / 720
+        img = img.cached_convert("RGB").cached_scale_to_height(720)
+        imgmat = img.array
+        use_anchor = None
+        if self.anchor is not None:
+            shift = self.pending_shift / scale
+            margin = (
+                SEARCH_MARGIN[0] + abs(shift[0]) / 2,
+                SEARCH_MARGIN[1] + abs(shift[1]) / 2,
+            )
+            templ, _ = _load_anchor(self.partition, self.anchor)
+            pos, score = _match_in_window(
+                imgmat, templ, self.anchor_pos + shift, margin
+            )
+            logger.debug("tracked anchor %s: %s %s", self.anchor, pos, score)
+            if score >= MATCH_THRESHOLD:
+                use_anchor = (self.anchor, pos, score)
+        self.pending_shift = np.zeros(2)
+        if use_anchor is None:
+            use_anchor = _locate_anchor(img, self.partition)
+        if use_anchor is None:
+            self.anchor = None
+            return None
+        logger.debug("use anchor: %s", repr(use_anchor))
+        set_score(use_anchor[2])
+        self.anchor, self.anchor_pos = use_anchor[0], np.asarray(use_anchor[1])
+        bias = (
+            np.asarray(use_anchor[1], dtype=np.int32)
+            - map_vectors.stage_maps[self.partition][use_anchor[0]]
+        )
+        logger.debug("bias: %s", bias)
+        result = {
+            name: (pos + bias) * scale
+            for name, pos in map_vectors.stage_maps[self.partition].items()
+        }
+        return result
+
+
+@traced
+def recognize_map(img, partition):
+    return MapTracker(partition).recognize(img)
+
+
+# 日常关卡入口图标较大，粗定位可以缩得更小
+DAILY_MENU_PYRAMID_SCALE = 0.25
+DAILY_MENU_THRESHOLD = 0.08
+# 粗定位得分高于此值的入口视为不在画面中，不再精确匹配
+DAILY_MENU_COARSE_THRESHOLD = 0.2
+
+
+@lru_cache(maxsize=None)
+def _prepare_daily_menu(partition):
+    """returns [(name, template, downscaled template)] of menu entries in partition"""
+    result = []
+    for filename in sorted(resources.get_entries("maps/" + partition)[1]):
+        if not filename.endswith(".png"):
+            continue
+        templ = np.asarray(
+            resources.load_image_cached("maps/%s/%s" % (partition, filename), "RGB")
+        )
+        small = cv.resize(
+            templ,
+            None,
+            fx=DAILY_MENU_PYRAMID_SCALE,
+            fy=DAILY_MENU_PYRAMID_SCALE,
+            interpolation=cv.INTER_AREA,
+        )
+        result.append((filename[:-4], templ, small))
     return result
 
 
 def recognize_daily_menu(img, partition):
     logger.debug("recognizing daily menu in partition %s", partition)
-    names = [x[:-4] for x in resources.get_entries("maps/" + partition)[1]]
     scale = img.height / 720
-    img = imgops.scale_to_height(img.convert("RGB"), 720)
-    imgmat = np.asarray(img)
-    match_results = [
-        (
-            name,
-            *imgops.match_template(
+    img = img.cached_convert("RGB").cached_scale_to_height(720)
+    imgmat = img.array
+    small_imgmat = img.cached_resize(
+        (img.width * DAILY_MENU_PYRAMID_SCALE, img.height * DAILY_MENU_PYRAMID_SCALE),
+        Image.BOX,
+    ).array
+    refine_margin = int(1 / DAILY_MENU_PYRAMID_SCALE) + REFINE_MARGIN
+    match_results = []
+    missed = []
+    for name, templ, small in _prepare_daily_menu(partition):
+        (x, y), conf = imgops.match_template(
+            small_imgmat, small, method=cv.TM_SQDIFF_NORMED
+        )
+        if conf < DAILY_MENU_COARSE_THRESHOLD:
+            pos, conf = _match_in_window(
                 imgmat,
-                resources.load_image_cached(
-                    "maps/%s/%s.png" % (partition, name), "RGB"
-                ),
+                templ,
+                (x / DAILY_MENU_PYRAMID_SCALE, y / DAILY_MENU_PYRAMID_SCALE),
+                (refine_margin, refine_margin),
                 method=cv.TM_SQDIFF_NORMED,
-            ),
-        )
-        for name in names
-    ]
+            )
+            if pos is not None and conf < DAILY_MENU_THRESHOLD:
+                match_results.append((name, pos, conf))
+                continue
+            # 粗定位找到了但精确匹配失败，可能是缩小后定位不准
+            missed.append((name, templ))
+    if not match_results:
+        # 粗定位可能错过缩小后细节丢失的入口，退回原尺寸全图匹配
+        missed = [(name, templ) for name, templ, _ in _prepare_daily_menu(partition)]
+    for name, templ in missed:
+        pos, conf = imgops.match_template(imgmat, templ, method=cv.TM_SQDIFF_NORMED)
+        match_results.append((name, pos, conf))
     logger.debug("%s", match_results)
     result = {
         name: (np.asarray(pos) * scale, conf)
         for name, pos, conf in match_results
-        if conf < 0.08
+        if conf < DAILY_MENU_THRESHOLD
     }
     return result
 
@@ -61,3 +61,7 @@ class OcrEngine(ABC):
 
     def recognize(self, image, ppi=70, hints=None, **kwargs) -> OcrResult:
         raise NotImplementedError()
+
+    def recognize_many(self, images, ppi=70, hints=None, **kwargs) -> List[OcrResult]:
+        """recognize images with the same parameters, results in input order"""
+        return [self.recognize(image, ppi, hints, **kwargs) for image in images]
@@ -1,5 +1,7 @@
 from util import cvimage
 from .common import *
+import copy
+import threading
 import cv2
 import numpy as np
 from functools import lru_cache
@@ -15,6 +17,30 @@ info = "ppocr"
 
 ocr = TextSystem()
 
+_variants = {None: ocr}
+_variants_lock = threading.Lock()
+
+
+def get_text_system(char_whitelist=None) -> TextSystem:
+    """
+    返回使用指定字符白名单的 TextSystem，白名单变体只构建一次并缓存。
+    各变体共享 ONNX 模型，且调用时不修改任何共享状态，因此可以在多个线程中同时使用。
+    """
+    if not char_whitelist:
+        return ocr
+    variant = _variants.get(char_whitelist)
+    if variant is None:
+        with _variants_lock:
+            variant = _variants.get(char_whitelist)
+            if variant is None:
+                recognizer = copy.copy(ocr.text_recognizer)
+                recognizer.postprocess_op = copy.copy(recognizer.postprocess_op)
+                recognizer.postprocess_op.set_char_mask(char_whitelist)
+                variant = copy.copy(ocr)
+                variant.text_recognizer = recognizer
+                _variants[char_whitelist] = variant
+    return variant
+
 
 # 模块说明，用于在 log 中显示
 def check_supported():
@@ -22,60 +48,74 @@ def check_supported():
     return True
 
 
+def _single_line_result(res):
+    if res and res[1] > 0.55:
+        return OcrResult([OcrLine([OcrWord(Rect(0, 0), w) for w in res[0].strip()])])
+    return OcrResult([])
+
+
 class PaddleOcr(OcrEngine):
+    def _is_single_line(self, image, hints):
+        if hints is not None and OcrHint.SINGLE_LINE in hints:
+            return True
+        return image.height < 35
+
     def recognize(self, image, ppi=70, hints=None, **kwargs):
         if image.mode != "BGR":
             image = image.convert("BGR")
-        if "char_whitelist" in kwargs:
-            ocr.set_char_whitelist(kwargs["char_whitelist"])
+        text_system = get_text_system(kwargs.get("char_whitelist"))
         cv_img = image.array
-        single_line_flag = image.height < 35
-        if hints is not None and OcrHint.SINGLE_LINE in hints:
-            single_line_flag = True
-        if single_line_flag:
-            res = ocr.ocr_single_line(cv_img)
+        if self._is_single_line(image, hints):
+            res = text_system.ocr_single_line(cv_img)
             logging.debug(f"PaddleOcr.recognize: {res}")
-            if res and res[1] > 0.55:
-                result = OcrResult(
-                    [OcrLine([OcrWord(Rect(0, 0), w) for w in res[0].strip()])]
-                )
-            else:
-                result = OcrResult([])
+            result = _single_line_result(res)
         else:
-            result = ocr.detect_and_ocr(cv_img)
+            result = text_system.detect_and_ocr(cv_img)
             logging.debug(f"PaddleOcr.recognize: {result}")
             line = [
                 OcrLine([OcrWord(Rect(0, 0), w) for w in box.ocr_text])
                 for box in result
             ]
             result = OcrResult(line)
-        if "char_whitelist" in kwargs:
-            ocr.set_char_whitelist(None)
         return result
 
+    def recognize_many(self, images, ppi=70, hints=None, **kwargs):
+        images = [
+            image if image.mode == "BGR" else image.convert("BGR") for image in images
+        ]
+        single_line_indices = [
+            i for i, image in enumerate(images) if self._is_single_line(image, hints)
+        ]
+        results = [None] * len(images)
+        if single_line_indices:
+            # 单行文本直接批量送入识别模型
+            text_system = get_text_system(kwargs.get("char_whitelist"))
+            rec_res = text_system.ocr_lines(
+                [images[i].array for i in single_line_indices]
+            )
+            logging.debug(f"PaddleOcr.recognize_many: {rec_res}")
+            for i, res in zip(single_line_indices, rec_res):
+                results[i] = _single_line_result(res)
+        for i, image in enumerate(images):
+            if results[i] is None:
+                results[i] = self.recognize(image, ppi, hints, **kwargs)
+        return results
+
 
 def ocr_for_single_line(img, cand_alphabet: str = None):
-    if cand_alphabet:
-        ocr.set_char_whitelist(cand_alphabet)
-    res = ocr.ocr_single_line(img)
+    res = get_text_system(cand_alphabet).ocr_single_line(img)
     if res:
         res = res[0]
-    if cand_alphabet:
-        ocr.set_char_whitelist(None)
     return res
 
 
 def do_ocr(img, cand_alphabet: str = None):
-    if cand_alphabet:
-        ocr.set_char_whitelist(cand_alphabet)
     res = ""
-    ocr_result = ocr.detect_and_ocr(img)
+    ocr_result = get_text_system(cand_alphabet).detect_and_ocr(img)
     for line in ocr_result:
         for ch in line:
             res += ch
     res = res.strip()
-    if cand_alphabet:
-        ocr.set_char_whitelist(None)
     return res
 
 
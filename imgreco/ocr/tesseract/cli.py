@@ -1,5 +1,7 @@
 import os
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 from imgreco.ocr.common import *
@@ -24,6 +26,21 @@ def get_version():
 
 check_supported = lambda: get_version() is not None
 
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # tesseract processes run outside of the GIL, fan out batches over a shared pool
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=os.cpu_count() or 4, thread_name_prefix="tesseract-cli"
+                )
+    return _executor
+
 
 class TesseractSubprocessEngine(BaseTesseractEngine):
     def __init__(self, lang, **kwargs):
@@ -43,8 +60,10 @@ class TesseractSubprocessEngine(BaseTesseractEngine):
         elif OcrHint.SPARSE in hints:
             extras.extend(("--psm", "11"))
         if "char_whitelist" in kwargs:
-            extras.extend(("-c", "tessedit_char_whitelist=" + kwargs["char_whitelist"]))
-        for key, value in kwargs:
+            extras.extend(
+                ("-c", "tessedit_char_whitelist=" + kwargs.pop("char_whitelist"))
+            )
+        for key, value in kwargs.items():
             extras.extend(("-c", key + "=" + value))
         tslang = self.tesslang
         imgbytesio = BytesIO()
@@ -65,6 +84,16 @@ class TesseractSubprocessEngine(BaseTesseractEngine):
         )
         return parse_hocr(BytesIO(proc.stdout))
 
+    def recognize_many(self, images, ppi=70, hints=None, **kwargs):
+        if len(images) <= 1:
+            return super().recognize_many(images, ppi, hints, **kwargs)
+        executor = _get_executor()
+        futures = [
+            executor.submit(self.recognize, image, ppi, hints, **kwargs)
+            for image in images
+        ]
+        return [future.result() for future in futures]
+
 
 Engine = TesseractSubprocessEngine
 
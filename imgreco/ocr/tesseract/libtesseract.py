@@ -1,6 +1,12 @@
 import sys
 import io
 import os
+import contextlib
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from ..common import *
 from .common import *
 import logging
@@ -16,34 +22,141 @@ check_supported = lambda: True
 version = tessbaseapi.version
 
 
+@dataclass
+class EnginePoolStats:
+    acquisitions: int = 0
+    queue_wait_time: float = 0.0
+    max_queue_wait_time: float = 0.0
+    recognitions: int = 0
+    recognize_time: float = 0.0
+
+
+class BaseAPIPool:
+    """initialized TessBaseAPI handles, each used by one thread at a time"""
+
+    def __init__(self, factory, size):
+        self.factory = factory
+        self.size = max(1, size)
+        self.stats = EnginePoolStats()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _try_create(self):
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        try:
+            return self.factory()
+        except:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def warm_up(self, count=None):
+        count = self.size if count is None else min(count, self.size)
+        while self._created < count:
+            baseapi = self._try_create()
+            if baseapi is None:
+                break
+            self._idle.put(baseapi)
+
+    @contextlib.contextmanager
+    def acquire(self):
+        t0 = time.perf_counter()
+        try:
+            baseapi = self._idle.get_nowait()
+        except queue.Empty:
+            baseapi = self._try_create() or self._idle.get()
+        wait_time = time.perf_counter() - t0
+        with self._lock:
+            self.stats.acquisitions += 1
+            self.stats.queue_wait_time += wait_time
+            self.stats.max_queue_wait_time = max(
+                self.stats.max_queue_wait_time, wait_time
+            )
+        try:
+            yield baseapi
+        finally:
+            self._idle.put(baseapi)
+
+    def record_recognition(self, elapsed):
+        with self._lock:
+            self.stats.recognitions += 1
+            self.stats.recognize_time += elapsed
+
+    def get_stats(self) -> EnginePoolStats:
+        with self._lock:
+            return replace(self.stats)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # shared by all engines, concurrency is bounded by each handle pool
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=os.cpu_count() or 4, thread_name_prefix="tesseract"
+                )
+    return _executor
+
+
+def get_default_pool_size():
+    if "app" in sys.modules:
+        import app
+
+        size = app.config.ocr.tesseract_pool_size
+        if size > 0:
+            return size
+    return min(os.cpu_count() or 1, 4)
+
+
 class LibTesseractEngine(BaseTesseractEngine):
-    def __init__(self, lang, **kwargs):
+    def __init__(self, lang, pool_size=None, **kwargs):
         super().__init__(lang, **kwargs)
-        vars = {"debug_file": os.devnull, "classify_enable_learning": "0"}
+        self.vars = {"debug_file": os.devnull, "classify_enable_learning": "0"}
         if "app" in sys.modules:
             import app
 
             if app.config.debug:
-                del vars["debug_file"]
-                vars["log_level"] = "0"
+                del self.vars["debug_file"]
+                self.vars["log_level"] = "0"
+        self.win32_use_utf8 = False
+        if pool_size is None:
+            pool_size = get_default_pool_size()
+        self.pool = BaseAPIPool(self._create_baseapi, pool_size)
+        # initialize the first handle synchronously to report errors early
+        self.pool.warm_up(1)
+        threading.Thread(
+            target=self.pool.warm_up, name="tesseract-warmup", daemon=True
+        ).start()
+        self.features = ("single_line_hint", "sparse_hint", "char_whitelist")
+
+    def _create_baseapi(self):
         try:
-            self.baseapi = tessbaseapi.BaseAPI(
-                self.tessdata_prefix, self.tesslang, vars=vars
+            return tessbaseapi.BaseAPI(
+                self.tessdata_prefix,
+                self.tesslang,
+                vars=self.vars,
+                win32_use_utf8=self.win32_use_utf8,
             )
         except UnicodeEncodeError:
-            if sys.platform == "win32":
+            if sys.platform == "win32" and not self.win32_use_utf8:
                 logger.warning(
                     "failed to encode tessdata prefix or language in CP_ACP, trying CRT UTF-8 hack"
                 )
-                self.baseapi = tessbaseapi.BaseAPI(
-                    self.tessdata_prefix, self.tesslang, vars=vars, win32_use_utf8=True
-                )
+                self.win32_use_utf8 = True
+                return self._create_baseapi()
             else:
                 raise
-        self.features = ("single_line_hint", "sparse_hint", "char_whitelist")
 
     def recognize(self, image, ppi=70, hints=None, **kwargs):
-        self.baseapi.set_image(image, ppi)
         if hints is None:
             hints = []
         tessvars = {}
@@ -56,17 +169,37 @@ class LibTesseractEngine(BaseTesseractEngine):
         for key, value in kwargs.items():
             tessvars[key] = value
 
-        old_tessvars = {name: self.baseapi.get_variable(name) for name in tessvars}
-        # logger.debug('old tessvars: %r', old_tessvars)
-        for name, value in tessvars.items():
-            self.baseapi.set_variable(name, value)
-        self.baseapi.recognize()
-        result = parse_hocr(io.BytesIO(self.baseapi.get_hocr()))
-        for name, value in old_tessvars.items():
-            self.baseapi.set_variable(name, value)
-        self.baseapi.clear()
+        with self.pool.acquire() as baseapi:
+            t0 = time.perf_counter()
+            old_tessvars = {name: baseapi.get_variable(name) for name in tessvars}
+            # logger.debug('old tessvars: %r', old_tessvars)
+            try:
+                baseapi.set_image(image, ppi)
+                for name, value in tessvars.items():
+                    baseapi.set_variable(name, value)
+                baseapi.recognize()
+                result = parse_hocr(io.BytesIO(baseapi.get_hocr()))
+            finally:
+                # reset the handle before returning it to the pool
+                for name, value in old_tessvars.items():
+                    baseapi.set_variable(name, value)
+                baseapi.clear()
+            self.pool.record_recognition(time.perf_counter() - t0)
         return result
 
+    def recognize_many(self, images, ppi=70, hints=None, **kwargs):
+        if len(images) <= 1 or self.pool.size == 1:
+            return super().recognize_many(images, ppi, hints, **kwargs)
+        # libtesseract releases the GIL, run one recognition per pooled handle
+        executor = _get_executor()
+        futures = [
+            executor.submit(self.recognize, image, ppi, hints, **kwargs)
+            for image in images
+        ]
+        results = [future.result() for future in futures]
+        logger.debug("tesseract pool stats: %r", self.pool.get_stats())
+        return results
+
 
 Engine = LibTesseractEngine
 
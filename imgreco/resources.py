@@ -184,3 +184,10 @@ def load_roi(
         bbox_matrix=bbox_matrix,
         native_resolution=native_resolution,
     )
+
+
+@lru_cache(maxsize=None)
+def load_roi_cached(
+    basename, image_mode="RGB", metafile=None, imgfile=None
+) -> RegionOfInterest_ghost:
+    return load_roi(basename, image_mode, metafile, imgfile)
@@ -3,9 +3,11 @@ from functools import lru_cache
 import cv2
 import numpy as np
 
+from util import cvimage as Image
 from util.richlog import get_logger
 from . import common
 from . import resources
+from .trace import traced
 
 idx2id = [
     "-",
@@ -65,8 +67,17 @@ def predict_cv(img, noise_size=None, model_name="chars"):
 
 
 def predict_char_images(char_imgs, model_name="chars"):
+    return predict_char_image_groups([char_imgs], model_name)[0]
+
+
+def predict_char_image_groups(char_img_groups, model_name="chars"):
+    """对多组字符图像进行一次性推理，按组返回识别结果"""
+    roi_list = [
+        np.expand_dims(resize_char(x), 2) for group in char_img_groups for x in group
+    ]
+    if not roi_list:
+        return ["" for _ in char_img_groups]
     net = _load_onnx_model(model_name)
-    roi_list = [np.expand_dims(resize_char(x), 2) for x in char_imgs]
     blob = cv2.dnn.blobFromImages(roi_list)
     net.setInput(blob)
     scores = net.forward()
@@ -74,7 +85,13 @@ def predict_char_images(char_imgs, model_name="chars"):
     # softmax = [common.softmax(score) for score in scores]
     # probs = [softmax[i][predicts[i]] for i in range(len(predicts))]
     # print(probs)
-    return "".join([idx2id[p] for p in predicts])
+    chars = [idx2id[p] for p in predicts]
+    res = []
+    offset = 0
+    for group in char_img_groups:
+        res.append("".join(chars[offset : offset + len(group)]))
+        offset += len(group)
+    return res
 
 
 def resize_char(img):
@@ -92,44 +109,31 @@ def resize_char(img):
 
 def crop_char_img(img, noise_size=None):
     h, w = img.shape[:2]
-    has_white = False
-    last_x = None
-    res = []
     if noise_size is None:
         noise_size = 3 if h > 40 else 2
-    for x in range(0, w):
-        for y in range(0, h - noise_size + 1):
-            has_white = False
-            flag = False
-            if img[y][x] > 127:
-                flag = True
-                for i in range(noise_size):
-                    if img[y + i][x] < 127:
-                        flag = False
-            if flag:
-                has_white = True
-                if not last_x:
-                    last_x = x
-                break
-        if not has_white and last_x:
-            if x - last_x >= noise_size // 2:
-                min_y = None
-                max_y = None
-                for y1 in range(0, h):
-                    has_white = False
-                    for x1 in range(last_x, x):
-                        if img[y1][x1] > 127:
-                            has_white = True
-                            if min_y is None:
-                                min_y = y1
-                            break
-                    if not has_white and min_y is not None and max_y is None:
-                        max_y = y1
-                        break
-                # cv2.imshow('test', img[min_y:max_y, last_x:x])
-                # cv2.waitKey()
-                res.append(img[min_y:max_y, last_x:x])
-            last_x = None
+    bright = img > 127
+    not_dark = img >= 127
+    # 一列中存在连续 noise_size 个非暗像素（首个需为亮像素）时视为有字符
+    span = max(h - noise_size + 1, 0)
+    runs = bright[:span].copy()
+    for i in range(1, noise_size):
+        runs &= not_dark[i : span + i]
+    has_white = runs.any(axis=0)
+    # 与原逐像素实现保持一致：第 0 列不作为字符起点
+    has_white[0:1] = False
+    edges = np.diff(has_white.astype(np.int8))
+    starts = np.flatnonzero(edges == 1) + 1
+    # 延伸到最右侧的字符没有结束列，由 zip 直接丢弃
+    ends = np.flatnonzero(edges == -1) + 1
+    res = []
+    for left, right in zip(starts, ends):
+        if right - left < noise_size // 2:
+            continue
+        rows = bright[:, left:right].any(axis=1)
+        min_y = int(rows.argmax())
+        gaps = np.flatnonzero(~rows[min_y:])
+        max_y = min_y + int(gaps[0]) if len(gaps) else None
+        res.append(img[min_y:max_y, left:right])
     return res
 
 
@@ -180,13 +184,30 @@ def remove_holes(img):
             cv2.drawContours(img, [contours[i]], 0, 0, -1)
 
 
-def recognize_stage_tags(pil_screen, template, ccoeff_threshold=0.75):
+def _prepare_screen(pil_screen):
     screen = pil_to_cv_gray_img(pil_screen)
     img_h, img_w = screen.shape[:2]
     ratio = 1080 / img_h
     if ratio != 1:
-        ratio = 1080 / img_h
         screen = cv2.resize(screen, (int(img_w * ratio), 1080))
+    return screen
+
+
+def prepare_screen(pil_screen):
+    ratio = 1080 / pil_screen.height
+    if isinstance(pil_screen, Image.Image):
+        # 同一帧多次识别时复用预处理结果
+        screen = pil_screen.cached_derive(
+            "stage_ocr.prepare_screen",
+            lambda: Image.Image(_prepare_screen(pil_screen), "L"),
+        ).array
+    else:
+        screen = _prepare_screen(pil_screen)
+    return screen, ratio
+
+
+def find_stage_tags(screen, ratio, template, ccoeff_threshold=0.75):
+    """在预处理后的截图中定位关卡标签并切分字符，返回 (pos, char_imgs) 列表"""
     result = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
     loc = np.where(result >= ccoeff_threshold)
     h, w = template.shape[:2]
@@ -209,21 +230,38 @@ def recognize_stage_tags(pil_screen, template, ccoeff_threshold=0.75):
             if tag is None:
                 continue
             remove_holes(tag)
-            tag_str = do_tag_ocr(tag, 3)
-            if len(tag_str) < 3:
+            logger.logimage(common.convert_to_pil(tag))
+            char_imgs = crop_char_img(tag, 3)
+            # 每个字符图像对应一个识别结果，因此无需推理即可排除过短的标签
+            if len(char_imgs) < 3:
+                logger.logtext("skipped tag with %d chars" % len(char_imgs))
                 if dbg_screen is None:
                     dbg_screen = screen.copy()
                 cv2.rectangle(dbg_screen, pt, (pt[0] + w + tag_w, pt[1] + h), 0, 3)
                 continue
             pos = (int((pt[0] + (tag_w / 2)) / ratio), int((pt[1] + 20) / ratio))
             # logger.logtext('pos: %s' % str(pos))
-            # res.append({'tag_img': tag, 'pos': (pt[0] + (tag_w / 2), pt[1] + 20), 'tag_str': tag_str})
-            res.append({"pos": pos, "tag_str": tag_str})
+            res.append((pos, char_imgs))
     if dbg_screen is not None:
         logger.logimage(common.convert_to_pil(dbg_screen))
     return res
 
 
+def _predict_stage_tags(found_tags):
+    tag_strs = predict_char_image_groups([char_imgs for _, char_imgs in found_tags])
+    res = []
+    for (pos, _), tag_str in zip(found_tags, tag_strs):
+        logger.logtext("res: %s" % tag_str)
+        res.append({"pos": pos, "tag_str": tag_str})
+    return res
+
+
+def recognize_stage_tags(pil_screen, template, ccoeff_threshold=0.75):
+    screen, ratio = prepare_screen(pil_screen)
+    found_tags = find_stage_tags(screen, ratio, template, ccoeff_threshold)
+    return _predict_stage_tags(found_tags)
+
+
 def do_tag_ocr(img, noise_size=None, model_name="chars"):
     logger.logimage(common.convert_to_pil(img))
     res = do_tag_ocr_dnn(img, noise_size, model_name)
@@ -255,13 +293,15 @@ normal_icons = [stage_icon1, stage_icon2]
 extra_icons = [stage_icon_ex1]
 
 
+@traced
 def recognize_all_screen_stage_tags(pil_screen, allow_extra_icons=False):
+    screen, ratio = prepare_screen(pil_screen)
+    icons = (extra_icons if allow_extra_icons else []) + normal_icons
+    found_tags = []
+    for icon in icons:
+        found_tags.extend(find_stage_tags(screen, ratio, icon))
+    # 所有图标找到的标签合并为一个 batch，只进行一次推理
     tags_map = {}
-    if allow_extra_icons:
-        for icon in extra_icons:
-            for tag in recognize_stage_tags(pil_screen, icon, 0.75):
-                tags_map[tag["tag_str"]] = tag["pos"]
-    for icon in normal_icons:
-        for tag in recognize_stage_tags(pil_screen, icon):
-            tags_map[tag["tag_str"]] = tag["pos"]
+    for tag in _predict_stage_tags(found_tags):
+        tags_map[tag["tag_str"]] = tag["pos"]
     return tags_map
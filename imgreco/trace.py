@@ -0,0 +1,329 @@
+"""
+structured trace of recognizer calls, for offline replay and benchmarking
+
+trace directory layout:
+    trace.jsonl     one record per recognizer call
+    blobs/*.png     input images, named by content hash
+
+recognizers report their score (best match coefficient, MSE, class
+probabilities...) with set_score(), recorded alongside the result.
+
+replay with `python -m imgreco replay <trace directory>`
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import enum
+import functools
+import hashlib
+import importlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from util import cvimage as Image
+
+logger = logging.getLogger(__name__)
+
+_recorder = None
+_recorder_lock = threading.Lock()
+_suppressed = threading.local()
+
+
+class TraceRecorder:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.blob_path = self.path / "blobs"
+        os.makedirs(self.blob_path, exist_ok=True)
+        self.file = open(self.path / "trace.jsonl", "a", encoding="utf-8")
+        self.known_blobs = set(x.stem for x in self.blob_path.glob("*.png"))
+        # 哈希、编码和写入都在后台线程中按顺序进行，识别线程只负责复制输入图像
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="imgreco-trace")
+
+    def _save_blob(self, mat: np.ndarray, mode: str):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(("%s %r %s" % (mode, mat.shape, mat.dtype)).encode())
+        digest.update(mat.data)
+        name = digest.hexdigest()
+        if name not in self.known_blobs:
+            im = Image.Image(mat, mode)
+            if mode == "1":
+                im = Image.Image(mat.astype(np.uint8) * 255, "L")
+            buf = im.imencode("png", [cv2.IMWRITE_PNG_COMPRESSION, 1])
+            with open(self.blob_path / (name + ".png"), "wb") as f:
+                f.write(buf)
+            self.known_blobs.add(name)
+        return name
+
+    def _write(self, record, images):
+        try:
+            for placeholder, mat, mode in images:
+                placeholder["$image"] = self._save_blob(mat, mode)
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+        except Exception:
+            logger.debug("failed to write trace record", exc_info=True)
+
+    def record(self, fn_name, args, kwargs, result, elapsed, score=None):
+        images = []
+
+        def convert_arg(value):
+            if isinstance(value, Image.Image):
+                placeholder = {"$image": None, "mode": value.mode}
+                images.append((placeholder, np.array(value.array), value.mode))
+                return placeholder
+            if isinstance(value, (list, tuple)):
+                return [convert_arg(x) for x in value]
+            return to_jsonable(value)
+
+        if score is None:
+            score = getattr(result, "score", None)
+        record = {
+            "fn": fn_name,
+            "time": time.time(),
+            "args": [convert_arg(x) for x in args],
+            "kwargs": {k: convert_arg(v) for k, v in kwargs.items()},
+            "score": to_jsonable(score),
+            "result": to_jsonable(result),
+            "elapsed": elapsed,
+        }
+        self.executor.submit(self._write, record, images)
+
+    def close(self):
+        self.executor.shutdown()
+        self.file.close()
+
+
+def to_jsonable(obj):
+    if obj is None or isinstance(obj, (bool, int, str)):
+        return obj
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else repr(obj)
+    if isinstance(obj, np.generic):
+        return to_jsonable(obj.item())
+    if isinstance(obj, enum.Enum):
+        return to_jsonable(obj.value)
+    if isinstance(obj, np.ndarray):
+        if obj.size <= 256:
+            return to_jsonable(obj.tolist())
+        return {"$ndarray": list(obj.shape), "dtype": str(obj.dtype)}
+    if isinstance(obj, Image.Image):
+        return {"$ndarray": list(obj.array.shape), "mode": obj.mode}
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {
+            f.name: to_jsonable(getattr(obj, f.name)) for f in dataclasses.fields(obj)
+        }
+    if isinstance(obj, dict):
+        return {str(k): to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [to_jsonable(x) for x in obj]
+    return {"$repr": repr(obj)}
+
+
+def get_recorder():
+    global _recorder
+    if _recorder is None:
+        import app
+
+        if not app.config.imgreco_trace:
+            return None
+        with _recorder_lock:
+            if _recorder is None:
+                path = app.logs / "trace" / time.strftime("%Y%m%d-%H%M%S")
+                if app.get_instance_id() != 0:
+                    path = path.with_name(path.name + ".%d" % app.get_instance_id())
+                _recorder = TraceRecorder(path)
+                import atexit
+
+                atexit.register(_recorder.close)
+                logger.info("recording recognition trace to %s", path)
+    return _recorder
+
+
+def set_score(score):
+    """
+    report the score of the traced call in progress (e.g. best match coefficient)
+
+    the last reported score is recorded, calls without one record result.score.
+    """
+    if getattr(_suppressed, "value", False):
+        _suppressed.score = score
+
+
+def traced(fn):
+    """record calls of a recognizer taking images, see module docstring"""
+    fn_name = fn.__module__ + "." + fn.__qualname__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        recorder = None if getattr(_suppressed, "value", False) else get_recorder()
+        if recorder is None:
+            return fn(*args, **kwargs)
+        # 嵌套调用只记录最外层
+        _suppressed.value = True
+        _suppressed.score = None
+        try:
+            t0 = time.perf_counter()
+            result = fn(*args, **kwargs)
+            elapsed = time.perf_counter() - t0
+        finally:
+            _suppressed.value = False
+            score, _suppressed.score = _suppressed.score, None
+        try:
+            recorder.record(fn_name, args, kwargs, result, elapsed, score)
+        except Exception:
+            logger.debug("failed to record trace", exc_info=True)
+        return result
+
+    return wrapper
+
+
+def load_trace(path):
+    path = Path(path)
+    with open(path / "trace.jsonl", "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _load_arg(path: Path, value):
+    if isinstance(value, list):
+        return [_load_arg(path, x) for x in value]
+    if isinstance(value, dict) and "$image" in value:
+        mode = value["mode"]
+        im = Image.open(path / "blobs" / (value["$image"] + ".png"))
+        if mode == "1":
+            return im.convert("L").convert("1")
+        return im.convert(mode) if im.mode != mode else im
+    return value
+
+
+def _is_replayable(value):
+    if isinstance(value, dict):
+        if "$repr" in value or "$ndarray" in value:
+            return False
+        return all(_is_replayable(v) for v in value.values())
+    if isinstance(value, list):
+        return all(_is_replayable(v) for v in value)
+    return True
+
+
+def results_equal(a, b, rel_tol=1e-4):
+    if isinstance(a, float) or isinstance(b, float):
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            return math.isclose(a, b, rel_tol=rel_tol, abs_tol=rel_tol)
+        return False
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(
+            results_equal(a[k], b[k], rel_tol) for k in a
+        )
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(
+            results_equal(x, y, rel_tol) for x, y in zip(a, b)
+        )
+    return a == b
+
+
+_histogram_buckets = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, math.inf]
+
+
+def _format_stats(times):
+    times = np.asarray(times) * 1000
+    return "mean %.2f ms, p50 %.2f ms, p95 %.2f ms, max %.2f ms" % (
+        times.mean(),
+        np.percentile(times, 50),
+        np.percentile(times, 95),
+        times.max(),
+    )
+
+
+def _format_histogram(times, width=40):
+    times = np.asarray(times) * 1000
+    counts = np.histogram(times, [0] + _histogram_buckets)[0]
+    lines = []
+    lower = 0
+    for upper, count in zip(_histogram_buckets, counts):
+        if count:
+            label = (
+                "%g-%g ms" % (lower, upper) if upper != math.inf else ">%g ms" % lower
+            )
+            bar = "#" * max(1, int(width * count / counts.max()))
+            lines.append("    %14s %5d %s" % (label, count, bar))
+        lower = upper
+    return "\n".join(lines)
+
+
+def replay(path, fn_filter=None, rel_tol=1e-4, verbose=False):
+    """re-run recognizers recorded in a trace, returns number of regressions"""
+    path = Path(path)
+    recorded_times = {}
+    replayed_times = {}
+    regressions = {}
+    skipped = 0
+    _suppressed.value = True
+    for index, record in enumerate(load_trace(path)):
+        fn_name = record["fn"]
+        if fn_filter and fn_filter not in fn_name:
+            continue
+        if not (_is_replayable(record["args"]) and _is_replayable(record["kwargs"])):
+            skipped += 1
+            continue
+        modname, _, qualname = fn_name.rpartition(".")
+        fn = getattr(importlib.import_module(modname), qualname)
+        fn = getattr(fn, "__wrapped__", fn)
+        args = [_load_arg(path, x) for x in record["args"]]
+        kwargs = {k: _load_arg(path, v) for k, v in record["kwargs"].items()}
+        t0 = time.perf_counter()
+        try:
+            result = to_jsonable(fn(*args, **kwargs))
+        except Exception as e:
+            result = {"$exception": repr(e)}
+        elapsed = time.perf_counter() - t0
+        recorded_times.setdefault(fn_name, []).append(record["elapsed"])
+        replayed_times.setdefault(fn_name, []).append(elapsed)
+        # 统一经过 JSON 往返，避免 tuple/list 之类的差异
+        result = json.loads(json.dumps(result))
+        if not results_equal(record["result"], result, rel_tol):
+            regressions.setdefault(fn_name, []).append(index)
+            print("REGRESSION #%d %s" % (index, fn_name))
+            print("    recorded: %s" % json.dumps(record["result"], ensure_ascii=False))
+            print("    replayed: %s" % json.dumps(result, ensure_ascii=False))
+        elif verbose:
+            print("ok #%d %s %.2f ms" % (index, fn_name, elapsed * 1000))
+
+    for fn_name, times in replayed_times.items():
+        print(
+            "%s: %d calls, %d regressions"
+            % (fn_name, len(times), len(regressions.get(fn_name, [])))
+        )
+        print("  recorded: " + _format_stats(recorded_times[fn_name]))
+        print("  replayed: " + _format_stats(times))
+        print(_format_histogram(times))
+    if skipped:
+        print("%d records skipped (arguments not replayable)" % skipped)
+    return sum(len(x) for x in regressions.values())
+
+
+def replay_main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="python -m imgreco replay",
+        description="re-run recognizers over a recorded trace",
+    )
+    parser.add_argument("trace", help="trace directory")
+    parser.add_argument("-f", "--filter", help="only replay functions matching")
+    parser.add_argument("--rel-tol", type=float, default=1e-4)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    regressions = replay(args.trace, args.filter, args.rel_tol, args.verbose)
+    return 1 if regressions else 0
@@ -1,5 +1,6 @@
 import numpy as np
-import urllib.request, json, time, os, copy
+import urllib.request, json, time, os, hashlib
+import scipy.sparse
 from scipy.optimize import linprog
 from . import arkplanner
 import app
@@ -12,6 +13,7 @@ LanguageMap = {"CN": "zh", "US": "en", "JP": "ja", "KR": "ko"}
 path_stats = app.cache_path.joinpath("matrix_cache.json")
 path_rules = app.cache_path.joinpath("formula_cache.json")
 path_aog_stages = app.cache_path.joinpath("aog_stages_cache.json")
+path_processed = app.cache_path.joinpath("planner_matrix_cache.npz")
 
 
 class MaterialPlanning(object):
@@ -82,7 +84,7 @@ class MaterialPlanning(object):
             item_id_to_name[v]["zh"]: k for k, v in enumerate(item_array)
         }  # from (zh) name to idx
 
-    def _pre_processing(self, material_probs):
+    def _pre_processing(self, material_probs, data_timestamp=None):
         """
         Compute costs, convertion rules and items probabilities from requested dictionaries.
         Args:
@@ -90,13 +92,13 @@ class MaterialPlanning(object):
                 Keys of instances: ["itemID", "times", "itemName", "quantity", "apCost", "stageCode", "stageID"].
             convertion_rules: List of dictionaries recording the rules of composing.
                 Keys of instances: ["id", "name", "level", "source", "madeof"].
+            data_timestamp: string identifying material_probs and convertion_rules.
+                Processed matrices are cached on disk if given.
         """
         # construct item id projections.
         # construct stage id projections.
-        stage_array = []
-        for drop in material_probs["matrix"]:
-            if drop["stageId"] not in stage_array:
-                stage_array.append(drop["stageId"])
+        drop_stage_ids = [drop["stageId"] for drop in material_probs["matrix"]]
+        stage_array = list(dict.fromkeys(drop_stage_ids))
         stage_dct_rv = {v: k for k, v in enumerate(stage_array)}
         servers = ["US"]  # ['CN', 'US', 'JP', 'KR']
         languages = ["en"]  # ['zh', 'en', 'ja', 'ko']
@@ -155,51 +157,121 @@ class MaterialPlanning(object):
 
         self.update_stage()
         self.stage_array = np.array(self.stage_array)
+        self.update_convertion()
+        self.convertions_dct = {
+            rule["name"]: {comp["name"]: comp["count"] for comp in rule["costs"]}
+            for rule in self.convertion_rules
+        }
+        self.convertion_cost_lst = [0] * len(self.convertion_rules)
+
+        cache_key = None
+        if data_timestamp is not None:
+            cache_key = self._processed_cache_key(data_timestamp)
+            if self._load_processed_cache(cache_key):
+                return
+        self._build_probs_matrix(material_probs["matrix"], drop_stage_ids)
+        self._build_convertion_matrices()
+        if cache_key is not None:
+            self._save_processed_cache(cache_key)
+
+    def _build_probs_matrix(self, drops, drop_stage_ids):
+        # 按列取出掉落记录，一次性写入矩阵
+        stage_idx = np.fromiter(
+            (self.stage_dct_rv[x] for x in drop_stage_ids),
+            dtype=np.intp,
+            count=len(drops),
+        )
+        item_idx = np.fromiter(
+            (self.item_dct_rv.get(drop["itemId"], -1) for drop in drops),
+            dtype=np.intp,
+            count=len(drops),
+        )
+        quantity = np.fromiter(
+            (drop["quantity"] for drop in drops), dtype=np.float64, count=len(drops)
+        )
+        times = np.fromiter(
+            (drop["times"] for drop in drops), dtype=np.float64, count=len(drops)
+        )
+        valid = (item_idx >= 0) & (times > 0)
+        if not valid.all():
+            unknown = sorted(set(drops[i]["itemId"] for i in np.flatnonzero(~valid)))
+            print(
+                f"Failed to parse {np.count_nonzero(~valid)} drops, items: {unknown}. (出现此条请带报错信息联系根派)"
+            )
         self.probs_matrix = np.zeros([len(self.stage_array), len(self.item_array)])
-
-        for drop in material_probs["matrix"]:
-            try:
-                self.probs_matrix[
-                    self.stage_dct_rv[drop["stageId"]], self.item_dct_rv[drop["itemId"]]
-                ] = drop["quantity"] / float(drop["times"])
-            except:
-                print(f"Failed to parse {drop}. (出现此条请带报错信息联系根派)")
+        self.probs_matrix[stage_idx[valid], item_idx[valid]] = (
+            quantity[valid] / times[valid]
+        )
 
         # 添加LS, CE, S4-6, S5-2等的掉落 及 默认龙门币掉落
-        for k, stage in enumerate(self.stage_array):
-            self.probs_matrix[k, self.item_name_rv["LMD"]] = self.cost_lst[k] * 12
+        self.probs_matrix[:, self.item_name_rv["LMD"]] = self.cost_lst * 12
         self.update_droprate()
 
+    def _build_convertion_matrices(self):
         # To build equavalence relationship from convert_rule_dct.
-        self.update_convertion()
-        self.convertions_dct = {}
-        convertion_matrix = []
-        convertion_outc_matrix = []
-        convertion_cost_lst = []
-        for rule in self.convertion_rules:
-            convertion = np.zeros(len(self.item_array))
+        n_rules = len(self.convertion_rules)
+        convertion_matrix = np.zeros([n_rules, len(self.item_array)])
+        convertion_outc_matrix = np.zeros([n_rules, len(self.item_array)])
+        for k, rule in enumerate(self.convertion_rules):
+            convertion = convertion_matrix[k]
             convertion[self.item_name_rv[rule["name"]]] = 1
-
-            comp_dct = {comp["name"]: comp["count"] for comp in rule["costs"]}
-            self.convertions_dct[rule["name"]] = comp_dct
-            for iname in comp_dct:
-                convertion[self.item_name_rv[iname]] -= comp_dct[iname]
+            for comp in rule["costs"]:
+                convertion[self.item_name_rv[comp["name"]]] -= comp["count"]
             convertion[self.item_name_rv["LMD"]] -= rule["goldCost"]
-            convertion_matrix.append(copy.deepcopy(convertion))
 
-            outc_dct = {outc["name"]: outc["count"] for outc in rule["extraOutcome"]}
-            outc_wgh = {outc["name"]: outc["weight"] for outc in rule["extraOutcome"]}
+            convertion_outc = convertion_outc_matrix[k]
+            convertion_outc[:] = convertion
             weight_sum = float(rule["totalWeight"])
-            for iname in outc_dct:
-                convertion[self.item_name_rv[iname]] += (
-                    outc_dct[iname] * self.ConvertionDR * outc_wgh[iname] / weight_sum
+            for outc in rule["extraOutcome"]:
+                convertion_outc[self.item_name_rv[outc["name"]]] += (
+                    outc["count"] * self.ConvertionDR * outc["weight"] / weight_sum
                 )
-            convertion_outc_matrix.append(convertion)
-            convertion_cost_lst.append(0)
 
-        self.convertion_matrix = np.array(convertion_matrix)
-        self.convertion_outc_matrix = np.array(convertion_outc_matrix)
-        self.convertion_cost_lst = convertion_cost_lst
+        self.convertion_matrix = convertion_matrix
+        self.convertion_outc_matrix = convertion_outc_matrix
+
+    def _processed_cache_key(self, data_timestamp):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(data_timestamp).encode())
+        digest.update(
+            json.dumps(
+                [
+                    self.stage_array.tolist(),
+                    self.item_array,
+                    self.convertion_rules,
+                    self.ConvertionDR,
+                ],
+                sort_keys=True,
+            ).encode()
+        )
+        digest.update(self.cost_lst.tobytes())
+        return digest.hexdigest()
+
+    def _load_processed_cache(self, cache_key):
+        try:
+            with np.load(path_processed) as data:
+                if str(data["key"]) != cache_key:
+                    return False
+                self.probs_matrix = data["probs_matrix"]
+                self.convertion_matrix = data["convertion_matrix"]
+                self.convertion_outc_matrix = data["convertion_outc_matrix"]
+            return True
+        except Exception:
+            return False
+
+    def _save_processed_cache(self, cache_key):
+        try:
+            tmppath = path_processed.with_suffix(".tmp.npz")
+            np.savez(
+                tmppath,
+                key=cache_key,
+                probs_matrix=self.probs_matrix,
+                convertion_matrix=self.convertion_matrix,
+                convertion_outc_matrix=self.convertion_outc_matrix,
+            )
+            os.replace(tmppath, path_processed)
+        except Exception as e:
+            print(f"Failed to save processed data, Error: {e}")
 
     def _set_lp_parameters(self):
         """
@@ -215,6 +287,41 @@ class MaterialPlanning(object):
         assert len(self.probs_matrix) == len(self.cost_lst)
         assert len(self.convertion_matrix) == len(self.convertion_cost_lst)
         assert self.probs_matrix.shape[1] == self.convertion_matrix.shape[1]
+        # 约束矩阵绝大部分为 0，以 CSR 格式保存，数据更新后才重新构建
+        self.probs_csr = scipy.sparse.csr_matrix(self.probs_matrix)
+        self.convertion_csr = scipy.sparse.csr_matrix(self.convertion_matrix)
+        self.convertion_outc_csr = scipy.sparse.csr_matrix(self.convertion_outc_matrix)
+        self._constraint_cache = {}
+
+    def _get_constraint_matrix(
+        self, is_stage_alive, outcome, convertion_dr, n_convertion
+    ):
+        """
+        Sparse [n_items, n_stages + n_convertion] matrix of items produced per
+        stage clear or convertion, cached until next data update.
+        """
+        is_stage_alive = np.asarray(is_stage_alive, dtype=bool)
+        key = (
+            np.packbits(is_stage_alive).tobytes(),
+            outcome,
+            convertion_dr,
+            n_convertion,
+        )
+        A_ub = self._constraint_cache.get(key)
+        if A_ub is None:
+            convertion_matrix = self.convertion_csr[:n_convertion]
+            if outcome:
+                convertion_outc_matrix = self.convertion_outc_csr[:n_convertion]
+                if convertion_dr != 0.18:
+                    convertion_outc_matrix = (
+                        convertion_outc_matrix - convertion_matrix
+                    ) / 0.18 * convertion_dr + convertion_matrix
+                convertion_matrix = convertion_outc_matrix
+            A_ub = scipy.sparse.vstack(
+                [self.probs_csr[np.flatnonzero(is_stage_alive)], convertion_matrix]
+            ).T.tocsr()
+            self._constraint_cache[key] = A_ub
+        return A_ub
 
     def update(
         self,
@@ -272,70 +379,52 @@ class MaterialPlanning(object):
                     filtered_probs.append(drop)
             material_probs["matrix"] = filtered_probs
 
-        if self._pre_processing(material_probs) != -1:
+        try:
+            data_timestamp = "%d:%d:%s:%s" % (
+                os.stat(path_stats).st_mtime_ns,
+                os.stat(path_rules).st_mtime_ns,
+                filter_freq,
+                sorted(filter_stages),
+            )
+        except OSError:
+            data_timestamp = None
+        if self._pre_processing(material_probs, data_timestamp) != -1:
             self._set_lp_parameters()
 
-    def _get_plan_no_prioties(
-        self,
-        demand_lst,
-        outcome,
-        gold_demand,
-        exp_demand,
-        convertion_dr,
-        probs_matrix,
-        convertion_matrix,
-        convertion_outc_matrix,
-        cost_lst,
-        convertion_cost_lst,
-    ):
+    def _get_plan_no_prioties(self, demand_lst, A_ub, cost_lst, convertion_cost_lst):
         """
         To solve linear programming problem without prioties.
         Args:
             demand_lst: list of materials demand. Should include all items (zero if not required).
+            A_ub: sparse matrix from _get_constraint_matrix.
         Returns:
-            strategy: list of required clear times for each stage.
-            fun: estimated total cost.
+            solution: scipy OptimizeResult of the primal problem.
+            item_values: dual value of each item.
+            excp_factor: scale applied to demand_lst.
         """
-        if convertion_dr != 0.18:
-            convertion_outc_matrix = (
-                convertion_outc_matrix - convertion_matrix
-            ) / 0.18 * convertion_dr + convertion_matrix
-        A_ub = (
-            np.vstack([probs_matrix, convertion_outc_matrix])
-            if outcome
-            else np.vstack([probs_matrix, convertion_matrix])
-        ).T
         cost = np.hstack([cost_lst, convertion_cost_lst])
         assert np.any(cost_lst >= 0)
 
         excp_factor = 1.0
-        dual_factor = 1.0
 
         while excp_factor > 1e-7:
             solution = linprog(
                 c=cost,
                 A_ub=-A_ub,
-                b_ub=-np.array(demand_lst) * excp_factor,
-                method="interior-point",
+                b_ub=-np.asarray(demand_lst) * excp_factor,
+                method="highs",
             )
             if solution.status != 4:
                 break
 
             excp_factor /= 10.0
 
-        while dual_factor > 1e-7:
-            dual_solution = linprog(
-                c=-np.array(demand_lst) * excp_factor * dual_factor,
-                A_ub=A_ub.T,
-                b_ub=cost,
-                method="interior-point",
-            )
-            if solution.status != 4:
-                break
-
-            dual_factor /= 10.0
-
-        return solution, dual_solution, excp_factor
+        # HiGHS 同时给出对偶解：约束右端项的边际值即物品价值
+        if solution.status == 0:
+            item_values = -solution.ineqlin.marginals
+        else:
+            item_values = None
+        return solution, item_values, excp_factor
 
     def get_plan(
         self,
@@ -422,25 +511,19 @@ class MaterialPlanning(object):
         probs_matrix = self.probs_matrix[is_stage_alive]
         stage_dct_rv = {v: k for k, v in enumerate(stage_array)}
 
-        solution, dual_solution, excp_factor = self._get_plan_no_prioties(
-            demand_lst,
-            outcome,
-            gold_demand,
-            exp_demand,
-            convertion_dr,
-            probs_matrix,
-            convertion_matrix,
-            convertion_outc_matrix,
-            cost_lst,
-            convertion_cost_lst,
+        A_ub = self._get_constraint_matrix(
+            is_stage_alive, outcome, convertion_dr, len(convertion_matrix)
         )
-        x, status = solution.x / excp_factor, solution.status
-        y, slack = dual_solution.x, dual_solution.slack
-        n_looting, n_convertion = x[: len(cost_lst)], x[len(cost_lst) :]
-
+        solution, y, excp_factor = self._get_plan_no_prioties(
+            demand_lst, A_ub, cost_lst, convertion_cost_lst
+        )
+        status = solution.status
         if status != 0:
             raise ValueError(status_dct[status])
 
+        x = solution.x / excp_factor
+        n_looting, n_convertion = x[: len(cost_lst)], x[len(cost_lst) :]
+
         values = [
             {"level": "1", "items": []},
             {"level": "2", "items": []},
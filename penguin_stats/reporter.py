@@ -1,6 +1,13 @@
 from __future__ import annotations
+import json
 import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from dataclasses import dataclass
+from pathlib import Path
 import app
 from resources.event import EXTRA_KNOWN_ITEMS, event_preprocess
 import requests
@@ -22,8 +29,17 @@ API_BASE = {
 }
 
 
-def api_endpoint(path):
-    return urljoin(API_BASE[app.config.combat.penguin_stats.endpoint], path)
+# background reporter
+REQUEST_TIMEOUT = 30
+MIN_RETRY_DELAY = 5
+MAX_RETRY_DELAY = 600
+MAX_BATCH_SIZE = 20
+
+
+def api_endpoint(path, base=None):
+    if base is None:
+        base = API_BASE[app.config.combat.penguin_stats.endpoint]
+    return urljoin(base, path)
 
 
 def _check_in_bound(bound, num):
@@ -45,6 +61,8 @@ class ReportResultOk(ReportResult):
 ReportResult.Ok = ReportResultOk
 ReportResult.NothingToReport = ReportResult()
 ReportResult.NotReported = ReportResult()
+# accepted by AsyncPenguinStatsReporter, will be posted in background
+ReportResult.Queued = ReportResult()
 
 
 class PenguinStatsReporter:
@@ -55,7 +73,8 @@ class PenguinStatsReporter:
         "Lucky Drops": "FURNITURE",
     }
 
-    def __init__(self):
+    def __init__(self, api_base=None):
+        self.api_base = api_base
         self.logged_in = False
         self.initialized = None
         self.noop = False
@@ -64,6 +83,8 @@ class PenguinStatsReporter:
         self.item_name_map: dict[str, Item] = {}
         self.cache_client = CachedSession(backend="memory", cache_control=True)
         self.client = requests.session()
+        # requests.Session 不保证线程安全，登录状态也保存在其中
+        self.client_lock = threading.RLock()
 
     def set_login_state_with_response(self, response: requests.Response):
         if userid := response.headers.get("X-Penguin-Set-Penguinid", None):
@@ -73,19 +94,21 @@ class PenguinStatsReporter:
         return userid
 
     def try_login(self, userid):
-        if self.logged_in:
+        with self.client_lock:
+            if self.logged_in:
+                return True
+            try:
+                logger.info("Signing in to Penguin Statistics, userID=%s", userid)
+                resp = self.client.post(
+                    api_endpoint("/PenguinStats/api/v2/users", self.api_base),
+                    data=str(userid),
+                )
+                resp.raise_for_status()
+            except:
+                logger.error("Login failed", exc_info=1)
+                return False
+            self.set_login_state_with_response(resp)
             return True
-        try:
-            logger.info("Signing in to Penguin Statistics, userID=%s", userid)
-            resp = self.client.post(
-                api_endpoint("/PenguinStats/api/v2/users"), data=str(userid)
-            )
-            resp.raise_for_status()
-        except:
-            logger.error("Login failed", exc_info=1)
-            return False
-        self.set_login_state_with_response(resp)
-        return True
 
     def initialize(self):
         if self.initialized is not None:
@@ -142,8 +165,12 @@ class PenguinStatsReporter:
             self.noop = True
 
     def update_penguin_data(self):
-        stages_resp = self.cache_client.get(api_endpoint("/PenguinStats/api/v2/stages"))
-        items_resp = self.cache_client.get(api_endpoint("/PenguinStats/api/v2/items"))
+        stages_resp = self.cache_client.get(
+            api_endpoint("/PenguinStats/api/v2/stages", self.api_base)
+        )
+        items_resp = self.cache_client.get(
+            api_endpoint("/PenguinStats/api/v2/items", self.api_base)
+        )
         if self.initialized and stages_resp.from_cache and items_resp.from_cache:
             return
         stages: list[Stage] = stages_resp.json()
@@ -151,6 +178,19 @@ class PenguinStatsReporter:
         self.set_penguin_data(stages, items)
 
     def report(self, recoresult: EndOperationResult):
+        req = self.build_report(recoresult)
+        if isinstance(req, ReportResult):
+            return req
+        try:
+            return ReportResult.Ok(self.post_report(req))
+        except:
+            logger.error("Report failed", exc_info=True)
+        return ReportResult.NotReported
+
+    def build_report(
+        self, recoresult: EndOperationResult
+    ) -> SingleReportRequest | ReportResult:
+        """validate recognition result, returns request to post or why not reporting"""
         if self.initialize() == False or self.noop:
             return ReportResult.NotReported
         logger.info("Reporting drops to Penguin Statistics")
@@ -294,25 +334,272 @@ class PenguinStatsReporter:
         )
 
         logger.debug("raw request: %r", req)
+        return req
+
+    def post_report(self, req: SingleReportRequest, timeout=None) -> str:
+        """returns report hash, raises on failure"""
+        with self.client_lock:
+            return self._post_report(req, timeout)
 
+    def _post_report(self, req: SingleReportRequest, timeout=None) -> str:
         if not self.logged_in:
             uid = app.config.combat.penguin_stats.uid
             if uid is not None:
                 self.try_login(uid)
+        # use cookie stored in session
+        resp = self.client.post(
+            api_endpoint("/PenguinStats/api/v2/report", self.api_base),
+            json=req,
+            timeout=timeout,
+        )
+        resp.raise_for_status()
+        if not self.logged_in:
+            userid = self.set_login_state_with_response(resp)
+            if userid is not None:
+                logger.info("Penguin Statistics User ID: %s", userid)
+                app.config.combat.penguin_stats.uid = userid
+                app.save()
+                logger.info("Written to configuration file.")
+        return resp.json().get("reportHash")
+
+
+def default_spool_path():
+    if app.get_instance_id() == 0:
+        filename = "penguin-report-spool.jsonl"
+    else:
+        filename = "penguin-report-spool.%d.jsonl" % app.get_instance_id()
+    return app.writable_root / filename
+
+
+class ReportSpool:
+    """
+    append-only file of reports not yet accepted by server
+
+    each line is either {"id": ..., "request": ...} or {"done": id},
+    the file is compacted when opened and when nothing is pending.
+    reports rejected by server are moved to a separate append-only file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.rejected_path = self.path.with_suffix(".rejected" + self.path.suffix)
+        self.lock = threading.Lock()
+        self.pending: OrderedDict[str, SingleReportRequest] = OrderedDict()
+        self.file = None
+        self._load()
+
+    def _load(self):
         try:
-            # use cookie stored in session
-            resp = self.client.post(
-                api_endpoint("/PenguinStats/api/v2/report"), json=req
-            )
-            resp.raise_for_status()
-            if not self.logged_in:
-                userid = self.set_login_state_with_response(resp)
-                if userid is not None:
-                    logger.info("Penguin Statistics User ID: %s", userid)
-                    app.config.combat.penguin_stats.uid = userid
-                    app.save()
-                    logger.info("Written to configuration file.")
-            return ReportResult.Ok(resp.json().get("reportHash"))
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 进程在写入时退出留下的不完整行
+                        continue
+                    if "done" in record:
+                        self.pending.pop(record["done"], None)
+                    elif "id" in record:
+                        self.pending[record["id"]] = record["request"]
+        except FileNotFoundError:
+            pass
+
+    def _open(self):
+        if self.file is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmppath = self.path.with_name(self.path.name + ".tmp")
+        with open(tmppath, "w", encoding="utf-8") as f:
+            for id, request in self.pending.items():
+                f.write(json.dumps({"id": id, "request": request}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmppath, self.path)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def _append(self, records):
+        for record in records:
+            self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def put(self, request: SingleReportRequest) -> str:
+        id = uuid.uuid4().hex
+        with self.lock:
+            self._open()
+            self._append([{"id": id, "time": time.time(), "request": request}])
+            self.pending[id] = request
+        return id
+
+    def peek(self, count) -> list[tuple[str, SingleReportRequest]]:
+        with self.lock:
+            return list(self.pending.items())[:count]
+
+    def __len__(self):
+        return len(self.pending)
+
+    def mark_rejected(self, rejections):
+        """move [(id, reason)] to rejected file, they are not retried"""
+        if not rejections:
+            return
+        with self.lock:
+            records = [
+                {
+                    "id": id,
+                    "time": time.time(),
+                    "reason": reason,
+                    "request": self.pending[id],
+                }
+                for id, reason in rejections
+                if id in self.pending
+            ]
+            with open(self.rejected_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        self.mark_done([id for id, _ in rejections])
+
+    def mark_done(self, ids):
+        with self.lock:
+            self._open()
+            for id in ids:
+                self.pending.pop(id, None)
+            if self.pending:
+                self._append([{"done": id} for id in ids])
+            else:
+                self.file.seek(0)
+                self.file.truncate()
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+@dataclass
+class ReporterStats:
+    queued: int = 0
+    posted: int = 0
+    rejected: int = 0
+    failed_attempts: int = 0
+
+
+class AsyncPenguinStatsReporter(PenguinStatsReporter):
+    """
+    validates reports in caller thread, posts them from a background thread
+
+    reports are written to a spool file first, so they survive network
+    failures and restarts; failed posts are retried with exponential backoff.
+    """
+
+    def __init__(self, spool_path=None, api_base=None):
+        super().__init__(api_base)
+        if spool_path is None:
+            spool_path = default_spool_path()
+        self.spool = ReportSpool(spool_path)
+        self.stats = ReporterStats()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._worker, name="penguin-reporter", daemon=True
+        )
+        if len(self.spool):
+            logger.info("%d drop reports pending from last run", len(self.spool))
+        self.thread.start()
+        import atexit
+
+        atexit.register(self.close)
+
+    def report(self, recoresult: EndOperationResult):
+        req = self.build_report(recoresult)
+        if isinstance(req, ReportResult):
+            return req
+        try:
+            self.spool.put(req)
         except:
-            logger.error("Report failed", exc_info=True)
-        return ReportResult.NotReported
+            logger.error("Failed to save report", exc_info=True)
+            return ReportResult.NotReported
+        self.stats.queued += 1
+        self.wakeup.set()
+        return ReportResult.Queued
+
+    def _post_batch(self) -> bool:
+        """post pending reports over the same connection, returns False on retryable failure"""
+        done = []
+        rejected = []
+        ok = True
+        for id, req in self.spool.peek(MAX_BATCH_SIZE):
+            if self.stopped.is_set():
+                break
+            try:
+                report_hash = self.post_report(req, timeout=REQUEST_TIMEOUT)
+                logger.debug("report %s posted, hash = %s", id, report_hash)
+                self.stats.posted += 1
+            except requests.HTTPError as e:
+                status = e.response.status_code
+                if 400 <= status < 500 and status not in (408, 429):
+                    # 重试也不会被接受，保留请求以便手动汇报
+                    logger.error(
+                        "Report rejected by Penguin Statistics, saved to %s: %s",
+                        self.spool.rejected_path,
+                        e,
+                    )
+                    self.stats.rejected += 1
+                    rejected.append((id, "%s: %s" % (e, e.response.text[:1000])))
+                    continue
+                else:
+                    logger.warning("Report failed, will retry later: %s", e)
+                    self.stats.failed_attempts += 1
+                    ok = False
+                    break
+            except Exception as e:
+                logger.warning("Report failed, will retry later: %r", e)
+                self.stats.failed_attempts += 1
+                ok = False
+                break
+            done.append(id)
+        if rejected:
+            self.spool.mark_rejected(rejected)
+        if done:
+            self.spool.mark_done(done)
+        return ok
+
+    def _worker(self):
+        backoff = 0
+        while not self.stopped.is_set():
+            if not len(self.spool):
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            if backoff and self.stopped.wait(backoff):
+                break
+            try:
+                ok = self._post_batch()
+            except Exception:
+                logger.error("Error in report worker", exc_info=True)
+                ok = False
+            if ok:
+                backoff = 0
+            else:
+                backoff = min(max(backoff * 2, MIN_RETRY_DELAY), MAX_RETRY_DELAY)
+
+    def flush(self, timeout=None) -> bool:
+        """wait until all pending reports are posted, returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self.spool):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout=5):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+        if not self.thread.is_alive():
+            self.spool.close()
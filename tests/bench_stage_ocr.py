@@ -0,0 +1,53 @@
+"""
+micro-benchmark of stage_ocr.crop_char_img against the reference implementation
+
+usage: python -m tests.bench_stage_ocr [repeat]
+"""
+
+import sys
+import timeit
+
+import cv2
+
+from imgreco.stage_ocr import crop_char_img, thresholding
+from . import stage_ocr_reference
+from .test_stage_ocr import render_tag, stage_ocr_images, tag_texts
+
+
+def load_samples():
+    samples = [("tag " + text, render_tag(text)) for text in tag_texts]
+    for path in stage_ocr_images:
+        gray = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+        tag = cv2.resize(gray, (127, 36), interpolation=cv2.INTER_AREA)
+        samples.append((path.name, thresholding(tag)))
+    return samples
+
+
+def main(repeat=200):
+    samples = load_samples()
+    print("%-20s %12s %12s %8s" % ("sample", "reference", "current", "speedup"))
+    total_ref = total_cur = 0
+    for name, img in samples:
+        t_ref = timeit.timeit(
+            lambda: stage_ocr_reference.crop_char_img(img), number=repeat
+        )
+        t_cur = timeit.timeit(lambda: crop_char_img(img), number=repeat)
+        total_ref += t_ref
+        total_cur += t_cur
+        print(
+            "%-20s %9.1f us %9.1f us %7.1fx"
+            % (name, t_ref / repeat * 1e6, t_cur / repeat * 1e6, t_ref / t_cur)
+        )
+    print(
+        "%-20s %9.1f us %9.1f us %7.1fx"
+        % (
+            "mean",
+            total_ref / repeat / len(samples) * 1e6,
+            total_cur / repeat / len(samples) * 1e6,
+            total_ref / total_cur,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
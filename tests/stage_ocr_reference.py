@@ -0,0 +1,43 @@
+"""reference implementations kept for equivalence tests and benchmarks"""
+
+
+def crop_char_img(img, noise_size=None):
+    """per-pixel glyph segmentation, as in stage_ocr before vectorization"""
+    h, w = img.shape[:2]
+    has_white = False
+    last_x = None
+    res = []
+    if noise_size is None:
+        noise_size = 3 if h > 40 else 2
+    for x in range(0, w):
+        for y in range(0, h - noise_size + 1):
+            has_white = False
+            flag = False
+            if img[y][x] > 127:
+                flag = True
+                for i in range(noise_size):
+                    if img[y + i][x] < 127:
+                        flag = False
+            if flag:
+                has_white = True
+                if not last_x:
+                    last_x = x
+                break
+        if not has_white and last_x:
+            if x - last_x >= noise_size // 2:
+                min_y = None
+                max_y = None
+                for y1 in range(0, h):
+                    has_white = False
+                    for x1 in range(last_x, x):
+                        if img[y1][x1] > 127:
+                            has_white = True
+                            if min_y is None:
+                                min_y = y1
+                            break
+                    if not has_white and min_y is not None and max_y is None:
+                        max_y = y1
+                        break
+                res.append(img[min_y:max_y, last_x:x])
+            last_x = None
+    return res
@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from automator.control.types import ControllerCapabilities
+from automator.mixin import AddonMixin
+from imgreco.common import RegionOfInterest
+from util import cvimage
+from util.framesig import DEFAULT_CHANGE_THRESHOLD, compute_signature
+
+viewport = (1280, 720)
+# 10x10 按钮中出现 6x6 的亮点，在整帧缩略图的 40x40 格子中被平均掉
+roi_ltrb = (604, 344, 614, 354)
+dot_ltrb = (606, 346, 612, 352)
+
+
+def make_frame(dot: bool) -> cvimage.Image:
+    mat = np.full((viewport[1], viewport[0], 3), 100, dtype=np.uint8)
+    if dot:
+        left, top, right, bottom = dot_ltrb
+        mat[top:bottom, left:right] = 180
+    return cvimage.Image(mat, "RGB")
+
+
+class FakeControl:
+    capabilities = ControllerCapabilities(0)
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.calls = 0
+
+    def screenshot(self, cached=None):
+        frame = self.frames[min(self.calls, len(self.frames) - 1)]
+        self.calls += 1
+        return frame
+
+    def frame_signature(self, image):
+        return compute_signature(image)
+
+
+class FakeAddon(AddonMixin):
+    def __init__(self, frames):
+        self.control = FakeControl(frames)
+        self.helper = SimpleNamespace(
+            control=self.control, frontend=SimpleNamespace(delay=lambda n, s: None)
+        )
+        self.viewport = viewport
+        self.matched = 0
+
+    def match_roi(self, roi, **kwargs):
+        self.matched += 1
+        return super().match_roi(roi, **kwargs)
+
+
+def make_roi():
+    left, top, right, bottom = roi_ltrb
+    template = make_frame(True).subview(roi_ltrb).copy()
+    return RegionOfInterest(
+        "test_dot", template, bbox=cvimage.Rect.from_ltrb(left, top, right, bottom)
+    )
+
+
+def test_small_change_below_frame_threshold():
+    before = compute_signature(make_frame(False))
+    after = compute_signature(make_frame(True))
+    assert not after.changed_from(before)
+    assert after.distance(before) <= DEFAULT_CHANGE_THRESHOLD
+
+
+def test_small_change_inside_rects():
+    before = compute_signature(make_frame(False), rects=[roi_ltrb])
+    after = compute_signature(make_frame(True), rects=[roi_ltrb])
+    assert after.changed_from(before)
+
+
+def test_rects_ignore_changes_elsewhere():
+    frame = make_frame(False)
+    mat = frame.array.copy()
+    mat[:100, :100] = 0
+    before = compute_signature(frame, rects=[roi_ltrb])
+    after = compute_signature(cvimage.Image(mat, "RGB"), rects=[roi_ltrb])
+    assert not after.changed_from(before)
+
+
+def test_wait_for_roi_rematches_small_change():
+    addon = FakeAddon([make_frame(False)] * 3 + [make_frame(True)])
+    result = addon.wait_for_roi(make_roi(), timeout=5)
+    assert result
+    assert addon.matched == 2
+
+
+def test_wait_for_any_roi_rematches_small_change():
+    addon = FakeAddon([make_frame(False)] * 3 + [make_frame(True)])
+    found, results = addon.wait_for_any_roi([make_roi()], timeout=5)
+    assert found
+    assert results["test_dot"]
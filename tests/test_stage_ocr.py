@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from imgreco.stage_ocr import crop_char_img, thresholding
+from . import stage_ocr_reference
+
+resource_root = Path(__file__).resolve().parent.parent / "resources" / "imgreco"
+stage_ocr_images = sorted((resource_root / "stage_ocr").glob("*.png"))
+tag_texts = ["1-7", "S4-10", "CE-5", "LS-5", "H8-4", "JT8-3", "11-20", "SK-5"]
+
+
+def render_tag(text, font_scale=1.0, thickness=2, height=36, width=127):
+    img = np.zeros((height, width), dtype=np.uint8)
+    cv2.putText(
+        img, text, (3, height - 8), cv2.FONT_HERSHEY_SIMPLEX, font_scale, 255, thickness
+    )
+    return img
+
+
+def assert_same_crops(img, noise_size=None):
+    expected = stage_ocr_reference.crop_char_img(img, noise_size)
+    actual = crop_char_img(img, noise_size)
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        assert a.shape == e.shape
+        assert np.array_equal(a, e)
+
+
+def test_shipped_images_present():
+    assert stage_ocr_images
+
+
+@pytest.mark.parametrize("path", stage_ocr_images, ids=lambda p: p.name)
+@pytest.mark.parametrize("noise_size", [None, 2, 3])
+def test_shipped_images(path, noise_size):
+    gray = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+    assert_same_crops(gray, noise_size)
+    assert_same_crops(thresholding(gray), noise_size)
+    # 与 cut_tag 相同的标签尺寸
+    tag = cv2.resize(gray, (127, 36), interpolation=cv2.INTER_AREA)
+    assert_same_crops(thresholding(tag), noise_size)
+
+
+@pytest.mark.parametrize("text", tag_texts)
+@pytest.mark.parametrize("font_scale,thickness", [(0.8, 1), (1.0, 2), (1.2, 3)])
+def test_rendered_tags(text, font_scale, thickness):
+    tag = render_tag(text, font_scale, thickness)
+    crops = crop_char_img(tag)
+    assert crops
+    assert_same_crops(tag)
+    assert_same_crops(tag, 3)
+
+
+def test_random_images():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        h = int(rng.integers(1, 48))
+        w = int(rng.integers(1, 64))
+        density = rng.uniform(0.05, 0.9)
+        img = np.where(rng.random((h, w)) < density, 255, 0).astype(np.uint8)
+        # 边界值 127 在两种比较中含义不同
+        img[rng.random((h, w)) < 0.05] = 127
+        assert_same_crops(img)
+        assert_same_crops(img, int(rng.integers(1, 5)))
@@ -215,6 +215,14 @@ class Rect:
         return iter((self.x, self.y, self.right(), self.bottom()))
 
 
+def rect_to_ltrb(rect) -> tuple[int, int, int, int]:
+    """integer (left, top, right, bottom) of a Rect or ltrb tuple"""
+    if isinstance(rect, Rect):
+        rect = rect.ltrb
+    left, top, right, bottom = (int(round(x)) for x in rect)
+    return left, top, right, bottom
+
+
 class Image:
     timestamp: Optional[float] = None
 
@@ -228,6 +236,7 @@ class Image:
                 f"multiple mode inferred from array shape {mat.shape!r} and dtype {mat.dtype!r}: {' '.join(valid_modes)}, you might want to explicitly specify a mode"
             )
         self._mode = mode or valid_modes[0]
+        self._derived = None
 
     # for use with numpy.asarray
     def __array__(self, dtype=None):
@@ -299,10 +308,7 @@ class Image:
     def subview(self, rect) -> Image:
         if rect is None:
             return self
-        if isinstance(rect, Rect):
-            left, top, right, bottom = (int(round(x)) for x in rect.ltrb)
-        else:
-            left, top, right, bottom = (int(round(x)) for x in rect)
+        left, top, right, bottom = rect_to_ltrb(rect)
         newmat = self._mat[top:bottom, left:right]
         return Image(newmat, self.mode)
 
@@ -362,6 +368,62 @@ class Image:
             newmat = cv2.cvtColor(self._mat, conv)
             return Image(newmat, target_pil_mode)
 
+    def cached_derive(self, key, fn) -> Image:
+        """memoize fn() on this image, see cached_convert"""
+        derived = self._derived
+        if derived is None:
+            derived = self._derived = {}
+        result = derived.get(key)
+        if result is None:
+            result = fn()
+            result._set_readonly()
+            result.timestamp = self.timestamp
+            derived[key] = result
+        return result
+
+    def invalidate_cache(self):
+        """drop memoized derived images, call after modifying this image in place"""
+        self._derived = None
+
+    def cached_convert(self, mode) -> Image:
+        """
+        convert(), memoized on this image
+
+        the result is read-only and shared between callers, this image must not
+        be modified afterwards (or call invalidate_cache).
+        """
+        if mode == self.mode:
+            return self.cached_derive(("convert", mode), self._readonly_view)
+        return self.cached_derive(("convert", mode), lambda: self.convert(mode))
+
+    def cached_resize(self, size, resample=None) -> Image:
+        """resize(), memoized on this image, see cached_convert"""
+        size = (int(round(size[0])), int(round(size[1])))
+        if size == self.size:
+            return self.cached_derive(("resize", size, None), self._readonly_view)
+        return self.cached_derive(
+            ("resize", size, resample), lambda: self.resize(size, resample)
+        )
+
+    def cached_scale_to_height(self, height, resample=BILINEAR) -> Image:
+        """scale keeping aspect ratio, memoized on this image, see cached_convert"""
+        scale = height / self.height
+        return self.cached_resize((int(self.width * scale), height), resample)
+
+    def cached_pyramid(self, levels) -> list[Image]:
+        """this image and (levels - 1) successive half-size images, see cached_convert"""
+        result = [self.cached_resize(self.size)]
+        for _ in range(levels - 1):
+            w, h = result[-1].size
+            result.append(result[-1].cached_resize((w / 2, h / 2), BOX))
+        return result
+
+    def _readonly_view(self):
+        return Image(self._mat.view(), self.mode)
+
+    def _set_readonly(self):
+        self._mat.flags.writeable = False
+
     def getbbox(self):
         mat = self._mat
         if mat.dtype == bool:
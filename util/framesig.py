@@ -0,0 +1,93 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional
+
+import time
+
+import cv2
+import numpy as np
+
+from util import cvimage
+
+SIGNATURE_SIZE = (32, 18)
+DEFAULT_CHANGE_THRESHOLD = 2
+
+_gray_conversions = {
+    "RGB": cv2.COLOR_RGB2GRAY,
+    "RGBA": cv2.COLOR_RGBA2GRAY,
+    "BGR": cv2.COLOR_BGR2GRAY,
+    "BGRA": cv2.COLOR_BGRA2GRAY,
+}
+
+
+@dataclass
+class FrameSignature:
+    """downsampled luminance of a frame, cheap to compare"""
+
+    thumbnail: np.ndarray
+    timestamp: float
+    # 仅采样这些区域时不为 None
+    rects: Optional[tuple] = None
+
+    def distance(self, other: FrameSignature) -> int:
+        """maximum luminance difference between corresponding cells"""
+        if self.thumbnail.shape != other.thumbnail.shape:
+            return 255
+        if self.thumbnail.size == 0:
+            return 0
+        return int(cv2.absdiff(self.thumbnail, other.thumbnail).max())
+
+    def mse_lower_bound(self, other: FrameSignature) -> float:
+        """lower bound of imgops.compare_mse between the full frames (RGB/RGBA/L)"""
+        if self.thumbnail.shape != other.thumbnail.shape:
+            return 0.0
+        diff = self.thumbnail.astype(np.float32) - other.thumbnail
+        # 亮度权重最大为 0.587，且 RGBA 按 4 通道平均：亮度 MSE <= 2.35 * 全图 MSE；
+        # 灰度转换和缩略图的取整误差每格合计不超过 2
+        rms = max(0.0, float(np.sqrt(np.mean(diff * diff))) - 2)
+        return rms * rms / 2.4
+
+    def changed_from(
+        self, other: Optional[FrameSignature], threshold=DEFAULT_CHANGE_THRESHOLD
+    ) -> bool:
+        if other is None:
+            return True
+        return self.distance(other) > threshold
+
+
+def _to_gray(image: cvimage.Image) -> np.ndarray:
+    if image.mode in _gray_conversions:
+        return cv2.cvtColor(image.array, _gray_conversions[image.mode])
+    elif image.mode == "L":
+        return image.array
+    else:
+        return image.convert("L").array
+
+
+def compute_signature(
+    image: cvimage.Image, timestamp: Optional[float] = None, rects=None
+) -> FrameSignature:
+    """
+    :param rects: sample only these (left, top, right, bottom) regions, each at up to
+                  SIGNATURE_SIZE, so that small changes inside them are not averaged away
+    """
+    if rects is None:
+        thumbnail = cv2.resize(
+            _to_gray(image), SIGNATURE_SIZE, interpolation=cv2.INTER_AREA
+        )
+    else:
+        parts = []
+        for rect in rects:
+            gray = _to_gray(image.subview(rect))
+            if gray.size == 0:
+                continue
+            size = (
+                min(SIGNATURE_SIZE[0], gray.shape[1]),
+                min(SIGNATURE_SIZE[1], gray.shape[0]),
+            )
+            parts.append(cv2.resize(gray, size, interpolation=cv2.INTER_AREA).ravel())
+        thumbnail = np.concatenate(parts) if parts else np.zeros(0, np.uint8)
+        rects = tuple(rects)
+    if timestamp is None:
+        timestamp = image.timestamp or time.monotonic()
+    return FrameSignature(thumbnail, timestamp, rects)
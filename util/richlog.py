@@ -1,5 +1,9 @@
 import os
-from base64 import b64encode
+import re
+import shutil
+import time
+import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import lru_cache
 from io import BytesIO
 import threading
@@ -8,34 +12,210 @@ from typing import BinaryIO
 from html import escape
 import atexit
 import cv2
+import numpy as np
 from util import cvimage
 
+# rotate log file when it grows larger than this, or older than MAX_FILE_AGE seconds
+MAX_FILE_SIZE = 32 * 1024 * 1024
+MAX_FILE_AGE = 6 * 60 * 60
+BACKUP_COUNT = 3
+# images waiting for encoding, further images are dropped instead of blocking the caller
+MAX_PENDING_IMAGES = 16
+ENCODER_THREADS = 2
+IMAGE_DIR = "richlog-images"
+
+
+_image_dir_meta = re.compile(rb'<meta name="richlog-images" content="([^"]*)">')
+
+
+def _read_image_dir(filename):
+    """image directory of an existing log file, from the header written by open()"""
+    try:
+        with open(filename, "rb") as f:
+            head = f.read(512)
+    except OSError:
+        return None
+    if m := _image_dir_meta.search(head):
+        return os.path.join(
+            os.path.dirname(os.fspath(filename)), m.group(1).decode("utf-8")
+        )
+    return None
+
+
+def _remove_images_of(filename):
+    if image_dir := _read_image_dir(filename):
+        shutil.rmtree(image_dir, ignore_errors=True)
+
+
+class _LogFile:
+    """
+    log file with rotation
+
+    each generation of the file (from creation or overwrite to rotated out)
+    keeps its images in its own directory under IMAGE_DIR, removed together
+    with the file.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.fspath(filename)
+        self.image_dir = None
+        self.io: BinaryIO = None
+        self.opened_at = 0
+        self.dropped_images = 0
+        self.known_images = set()
+
+    def _backup_name(self, index):
+        base, ext = os.path.splitext(self.filename)
+        return "%s.%d%s" % (base, index, ext)
+
+    def _new_image_dir(self):
+        stem = os.path.splitext(os.path.basename(self.filename))[0]
+        name = "%s-%s-%s" % (stem, time.strftime("%Y%m%d-%H%M%S"), os.urandom(4).hex())
+        return os.path.join(os.path.dirname(self.filename), IMAGE_DIR, name)
+
+    def _prune_image_dirs(self):
+        """remove image directories of this file not referenced by it or its backups"""
+        root = os.path.join(os.path.dirname(self.filename), IMAGE_DIR)
+        stem = os.path.splitext(os.path.basename(self.filename))[0]
+        retained = {os.path.normpath(self.image_dir)}
+        for i in range(1, BACKUP_COUNT + 1):
+            if image_dir := _read_image_dir(self._backup_name(i)):
+                retained.add(os.path.normpath(image_dir))
+        try:
+            entries = os.listdir(root)
+        except OSError:
+            return
+        for name in entries:
+            path = os.path.normpath(os.path.join(root, name))
+            # 本文件各代以外的目录（如异常退出后遗留的）
+            if name.startswith(stem + "-") and path not in retained:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def open(self, overwrite):
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        if overwrite:
+            _remove_images_of(self.filename)
+        self.io = open(self.filename, "wb" if overwrite else "ab")
+        self.opened_at = time.monotonic()
+        self.known_images = set()
+        if self.io.tell() == 0:
+            self.image_dir = self._new_image_dir()
+            self.io.write(
+                b'<html><head><meta charset="utf-8">'
+                b'<meta name="richlog-images" content="%s"></head><body>'
+                % escape(
+                    os.path.relpath(
+                        self.image_dir, os.path.dirname(self.filename)
+                    ).replace(os.sep, "/")
+                ).encode("utf-8")
+            )
+            self.io.flush()
+            self._prune_image_dirs()
+        else:
+            self.image_dir = _read_image_dir(self.filename) or self._new_image_dir()
+
+    def should_rotate(self):
+        return (
+            self.io.tell() >= MAX_FILE_SIZE
+            or time.monotonic() - self.opened_at >= MAX_FILE_AGE
+        )
+
+    def rotate(self):
+        self.io.close()
+        if BACKUP_COUNT > 0:
+            # 最旧的备份将被覆盖，它的图像一并删除
+            _remove_images_of(self._backup_name(BACKUP_COUNT))
+            for i in range(BACKUP_COUNT - 1, 0, -1):
+                src = self._backup_name(i)
+                if os.path.exists(src):
+                    os.replace(src, self._backup_name(i + 1))
+            os.replace(self.filename, self._backup_name(1))
+        self.open(True)
+
+    def save_image(self, name, buf):
+        """write encoded image into the directory of this generation"""
+        if name in self.known_images:
+            return
+        path = os.path.join(self.image_dir, name)
+        if not os.path.exists(path):
+            os.makedirs(self.image_dir, exist_ok=True)
+            tmppath = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmppath, "wb") as f:
+                f.write(buf)
+            os.replace(tmppath, path)
+        self.known_images.add(name)
+
+    def close(self):
+        if self.io is not None:
+            self.io.close()
+            self.io = None
+
+
+def _encode_image(mat: np.ndarray, mode: str):
+    """returns content-addressed file name and encoded image"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(("%s %r %s" % (mode, mat.shape, mat.dtype)).encode())
+    digest.update(np.ascontiguousarray(mat).data)
+    name = digest.hexdigest() + ".webp"
+    if mode == "1":
+        im = cvimage.Image(mat.astype(np.uint8) * 255, "L")
+    else:
+        im = cvimage.Image(mat, mode)
+    buf = im.imencode("webp", [cv2.IMWRITE_WEBP_QUALITY, 101])  # lossless
+    return name, buf
+
 
 class _richlog_worker(threading.Thread):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.queue = Queue(32)
+        self.queue = Queue()
         self.lock = threading.Lock()
-        self.files = {}
+        self.files: dict[str, _LogFile] = {}
         self.daemon = True
+        self.encoder = ThreadPoolExecutor(
+            ENCODER_THREADS, thread_name_prefix="richlog-encoder"
+        )
+        self.pending_images = 0
+        self.closed = False
 
     def open(self, filename, overwrite=False) -> bool:
         if filename not in self.files:
             with self.lock:
                 if filename not in self.files:
-                    f = open(filename, "wb" if overwrite else "ab")
-                    if f.tell() == 0:
-                        f.write(b'<html><head><meta charset="utf-8"></head><body>')
+                    f = _LogFile(filename)
+                    f.open(overwrite)
                     self.files[filename] = f
                     return True
         return False
 
+    def _write_image(self, f: _LogFile, future: Future):
+        try:
+            name, buf = future.result()
+            f.save_image(name, buf)
+        except Exception as e:
+            f.io.write(
+                b"<pre>(failed to save image: %s)</pre>\n"
+                % escape(repr(e)).encode("utf-8")
+            )
+            return
+        finally:
+            with self.lock:
+                self.pending_images -= 1
+        src = os.path.relpath(
+            os.path.join(f.image_dir, name), os.path.dirname(f.filename)
+        ).replace(os.sep, "/")
+        f.io.write(b'<p><img src="%s"></p>\n' % escape(src).encode("utf-8"))
+
     def run(self):
         while (record := self.queue.get()) is not None:
             try:
                 file, overwrite, msgtype, msg = record
                 self.open(file, overwrite)
-                io: BinaryIO = self.files[file]
+                f = self.files[file]
+                io: BinaryIO = f.io
+                if msgtype != "dropped" and f.dropped_images:
+                    io.write(b"<p>(%d images dropped)</p>\n" % f.dropped_images)
+                    f.dropped_images = 0
                 if msgtype == "html":
                     if isinstance(msg, str):
                         msg = msg.encode("utf-8")
@@ -43,27 +223,31 @@ class _richlog_worker(threading.Thread):
                 elif msgtype == "text":
                     io.write(b"<pre>%s</pre>\n" % escape(msg).encode("utf-8"))
                 elif msgtype == "image":
-                    from PIL import Image as PILImage
-
-                    im: PILImage.Image = msg
-                    io.write(b'<p><img src="data:image/webp;base64,')
-                    bio = BytesIO()
-                    im.save(bio, "webp", lossless=True, quality=0, method=0)
-                    io.write(b64encode(bio.getbuffer()))
-                    io.write(b'"></p>\n')
+                    self._write_image(f, msg)
+                elif msgtype == "dropped":
+                    f.dropped_images += 1
                 io.flush()
-                self.queue.task_done()
-            except Exception as e:
+                if f.should_rotate():
+                    f.rotate()
+            except Exception:
                 import traceback
 
                 traceback.print_exc()
-                pass
+            finally:
+                self.queue.task_done()
         self.queue.task_done()
 
     def close(self):
-        self.queue.put(None)
-        self.queue.join()
+        with self.lock:
+            stop_worker = self.is_alive() and not self.closed
+            self.closed = True
+        if stop_worker:
+            self.queue.put(None)
+            self.queue.join()
+        self.encoder.shutdown()
         for f in self.files.values():
+            if f.dropped_images and f.io is not None:
+                f.io.write(b"<p>(%d images dropped)</p>\n" % f.dropped_images)
             f.close()
 
     def loghtml(self, file, overwrite, html):
@@ -75,10 +259,20 @@ class _richlog_worker(threading.Thread):
     def logimage(self, file, overwrite, im: cvimage.Image):
         if im is None:
             return
-        pil_im = im.to_pil(
-            always_copy=True
-        )  # PIL Image.save is much more usable than OpenCV imwrite/imencode
-        self.queue.put((file, overwrite, "image", pil_im))
+        with self.lock:
+            accepted = self.pending_images < MAX_PENDING_IMAGES
+            if accepted:
+                self.pending_images += 1
+        if not accepted:
+            # 编码跟不上时丢弃图像，避免阻塞识别线程
+            self.queue.put((file, overwrite, "dropped", None))
+            return
+        mat = im.array
+        if mat.flags.writeable:
+            # the caller may draw on the image after logging it, keep a snapshot
+            mat = mat.copy()
+        future = self.encoder.submit(_encode_image, mat, im.mode)
+        self.queue.put((file, overwrite, "image", future))
 
 
 _worker = _richlog_worker()
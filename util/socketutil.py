@@ -7,19 +7,37 @@ import numpy as np
 logger = logging.getLogger(__name__)
 
 
-def recvexactly(sock, n, return_buffer=False):
-    buf = np.empty(n, dtype=np.uint8)
+def recvexactly_into(sock, buf):
+    """fill a writable contiguous buffer from socket"""
+    view = memoryview(buf).cast("B")
+    n = len(view)
     pos = 0
     while pos < n:
-        rcvlen = sock.recv_into(buf[pos:])
+        rcvlen = sock.recv_into(view[pos:])
         pos += rcvlen
         if rcvlen == 0:
             break
     if pos != n:
         raise EOFError("recvexactly %d bytes failed" % n)
+    return buf
+
+
+def recvexactly(sock, n, return_buffer=False):
+    buf = recvexactly_into(sock, np.empty(n, dtype=np.uint8))
     return buf.data if return_buffer else buf.tobytes()
 
 
+def drain(sock, chunklen=65536):
+    """discard remaining data until EOF, returns number of bytes discarded"""
+    buf = np.empty(chunklen, dtype=np.uint8)
+    total = 0
+    while True:
+        rcvlen = sock.recv_into(buf)
+        if rcvlen == 0:
+            return total
+        total += rcvlen
+
+
 def recvall(sock, chunklen=65536, return_buffer=False):
     buffers = []
     current_buf = np.empty(chunklen, dtype=np.uint8)